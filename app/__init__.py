@@ -5,13 +5,16 @@ import os
 from app.config import Config
 from app.database import db
 from app.routes import register_blueprints
+from app.cli import register_commands
+from app.metrics import init_metrics
+from app.lazy import preload, preload_enabled
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
-    # Enable CORS
-    CORS(app)
+    # Enable CORS, letting the frontend read the pagination headers
+    CORS(app, expose_headers=["X-Next-Cursor", "Link", "X-Total-Count"])
 
     # Configure JWT
     JWTManager(app)
@@ -19,9 +22,19 @@ def create_app():
     # Initialize database
     db.init_app(app)
 
+    # Record per-endpoint latency and resource metrics, exposed on /metrics
+    init_metrics(app)
+
     # Register blueprints
     register_blueprints(app)
 
+    # Register management commands
+    register_commands(app)
+
+    # Heavy dependencies load on first use unless asked to load them now (gunicorn --preload)
+    if preload_enabled():
+        preload()
+
     # Home route
     @app.route('/')
     def home():
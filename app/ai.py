@@ -0,0 +1,160 @@
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import Future
+from app.ai_preprocess import preprocess
+from app.cache import TTLCache
+from app.lazy import lazy_import
+from app.metrics import registry, stage
+
+openai = lazy_import("openai")
+
+# AZURE_OPENAI_ENDPOINT can point at a local stub (flask ai-stub) instead of Azure
+api_key = os.getenv("AZURE_OPENAI_API_KEY")
+endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", "https://openai1012.openai.azure.com/")
+api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-05-01-preview")
+deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")
+max_tokens = int(os.getenv("AI_MAX_TOKENS", 2000))
+request_timeout = float(os.getenv("AI_TIMEOUT_SECONDS", 120))
+
+SYSTEM_PROMPT = "You are a helpful assistant helping people answer questions related to the image. Please provide an answer to the question in plain text."
+
+# Answers are cached per (image, question, history); identical requests in flight share one call
+response_cache = TTLCache(int(os.getenv("AI_CACHE_TTL_SECONDS", 3600)), int(os.getenv("AI_CACHE_MAX_ENTRIES", 512)))
+
+_lock = threading.Lock()
+_client = None
+_in_flight = {}  # cache key -> Future of the answer
+
+# One client per process, so its HTTP connection pool is reused across requests
+def get_client():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = openai.AzureOpenAI(
+                api_key=api_key,
+                api_version=api_version,
+                azure_endpoint=endpoint,
+                timeout=request_timeout,
+            )
+        return _client
+
+def trim_history(history):
+    return (history or "").strip()
+
+def cache_key(image_bytes, mime_type, question, history):
+    digest = hashlib.sha256()
+    for part in (hashlib.sha256(image_bytes).digest(), mime_type.encode(), question.encode(), history.encode()):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+def build_messages(image_bytes, mime_type, question, history):
+    data_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Chat history FYI:" + history},
+                {"type": "text", "text": "Answer this question:" + question},
+                {"type": "image_url", "image_url": {"url": data_url}}
+            ]
+        }
+    ]
+
+def complete(messages):
+    with stage("ai"):
+        response = get_client().chat.completions.create(model=deployment_name, messages=messages, max_tokens=max_tokens)
+    return response.choices[0].message.content
+
+# Answer a question about a chart image; returns (answer, source) where source is hit, coalesced or miss
+def ask(image_bytes, mime_type, question, history):
+    history = trim_history(history)
+    key = cache_key(image_bytes, mime_type, question, history)
+
+    answer = response_cache.get(key)
+    if answer is not None:
+        return record_ai(answer, "hit")
+
+    future, leader = claim(key)
+    if not leader:
+        with stage("ai"):
+            return record_ai(future.result(), "coalesced")
+
+    try:
+        # Only calls that reach the model pay for preprocessing; the cache key uses the raw input
+        image_bytes, mime_type, history = preprocess(image_bytes, mime_type, history)
+        answer = complete(build_messages(image_bytes, mime_type, question, history))
+        if answer is not None:
+            response_cache.set(key, answer)
+        future.set_result(answer)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        release(key)
+    return record_ai(answer, "miss")
+
+# Same as ask, but yields the answer piece by piece as the model generates it
+def stream_ask(image_bytes, mime_type, question, history):
+    history = trim_history(history)
+    key = cache_key(image_bytes, mime_type, question, history)
+
+    answer = response_cache.get(key)
+    if answer is not None:
+        record_ai(answer, "hit")
+        yield answer
+        return
+
+    future, leader = claim(key)
+    if not leader:
+        answer, _ = record_ai(future.result(), "coalesced")
+        yield answer
+        return
+
+    parts = []
+    try:
+        image_bytes, mime_type, history = preprocess(image_bytes, mime_type, history)
+        stream = get_client().chat.completions.create(
+            model=deployment_name,
+            messages=build_messages(image_bytes, mime_type, question, history),
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield parts[-1]
+        finally:
+            stream.close()  # Also when the client went away mid-answer
+
+        answer = "".join(parts)
+        response_cache.set(key, answer)
+        record_ai(answer, "miss")
+        future.set_result(answer)
+    except BaseException as e:
+        # Requests waiting on this answer fail with the stream, including when it was abandoned
+        future.set_exception(e if isinstance(e, Exception) else RuntimeError("AI stream was closed"))
+        raise
+    finally:
+        release(key)
+
+# Become the caller that computes the answer for key, or get the future of the one already doing so
+def claim(key):
+    with _lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future, False
+        future = _in_flight[key] = Future()
+        return future, True
+
+def release(key):
+    with _lock:
+        _in_flight.pop(key, None)
+
+def record_ai(answer, source):
+    registry.inc("edna_ai_requests_total", (("source", source),))
+    return answer, source
@@ -0,0 +1,102 @@
+import io
+import json
+import os
+import re
+from app.lazy import lazy_import
+from app.metrics import registry, stage
+
+Image = lazy_import("PIL.Image")
+
+# Charts are sent at a bounded resolution; the model tiles large images anyway
+image_max_side = int(os.getenv("AI_IMAGE_MAX_SIDE", 1024))
+image_format = os.getenv("AI_IMAGE_FORMAT", "JPEG")
+image_quality = int(os.getenv("AI_IMAGE_QUALITY", 85))
+
+# The chat history is capped to a token budget: recent turns verbatim, older ones condensed
+history_token_budget = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", 1500))
+summary_token_budget = int(os.getenv("AI_HISTORY_SUMMARY_TOKENS", 300))
+summary_turn_chars = 160
+
+CHARS_PER_TOKEN = 4  # Rough average for English text
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+# Downscale and re-encode the image; returns (bytes, mime type), keeping the original when that is smaller
+def shrink_image(image_bytes, mime_type):
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.thumbnail((image_max_side, image_max_side), Image.LANCZOS)
+            if image_format.upper() == "JPEG" and image.mode != "RGB":
+                # Charts have transparent backgrounds; flatten them onto white
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+                image = background
+            output = io.BytesIO()
+            image.save(output, format=image_format, quality=image_quality, optimize=True)
+    except Exception as e:
+        print(f"Error shrinking image: {e}")
+        return image_bytes, mime_type
+
+    if output.tell() >= len(image_bytes):
+        return image_bytes, mime_type
+    return output.getvalue(), f"image/{image_format.lower()}"
+
+# The frontend sends the history either as a JSON list of messages or as plain text, one turn per line
+def parse_turns(history):
+    try:
+        messages = json.loads(history)
+    except ValueError:
+        messages = None
+    if isinstance(messages, list):
+        turns = []
+        for message in messages:
+            if isinstance(message, dict):
+                role = message.get("role") or message.get("sender") or "user"
+                content = message.get("content") or message.get("text") or ""
+                turns.append(f"{role}: {content}")
+            else:
+                turns.append(str(message))
+        return turns
+    return [line for line in history.splitlines() if line.strip()]
+
+def condense(turn):
+    first_sentence = re.split(r"(?<=[.!?])\s", turn.strip(), maxsplit=1)[0]
+    return first_sentence[:summary_turn_chars]
+
+# Keep the newest turns that fit the budget and condense older ones into a short extractive summary
+def compact_history(history):
+    if estimate_tokens(history) <= history_token_budget:
+        return history
+
+    turns = parse_turns(history)
+    recent_budget = history_token_budget - summary_token_budget
+    kept = []
+    used = 0
+    for turn in reversed(turns):
+        tokens = estimate_tokens(turn) + 1
+        if kept and used + tokens > recent_budget:
+            break
+        kept.append(turn[:recent_budget * CHARS_PER_TOKEN])
+        used += tokens
+    kept.reverse()
+
+    older = turns[:len(turns) - len(kept)]
+    if not older:
+        return "\n".join(kept)
+    summary = "Earlier conversation, condensed: " + " | ".join(condense(turn) for turn in older)
+    max_summary_chars = summary_token_budget * CHARS_PER_TOKEN
+    if len(summary) > max_summary_chars:
+        # The most recent of the older turns matter most
+        summary = "Earlier conversation, condensed: ..." + summary[-(max_summary_chars - 36):]
+    return summary + "\n" + "\n".join(kept)
+
+# Shrink what goes to the model and record what was saved
+def preprocess(image_bytes, mime_type, history):
+    with stage("ai_preprocess"):
+        small_image, small_mime_type = shrink_image(image_bytes, mime_type)
+        short_history = compact_history(history)
+
+    registry.inc("edna_ai_image_bytes_saved_total", (), len(image_bytes) - len(small_image))
+    registry.inc("edna_ai_history_tokens_saved_total", (), estimate_tokens(history) - estimate_tokens(short_history))
+    return small_image, small_mime_type, short_history
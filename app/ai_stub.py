@@ -0,0 +1,82 @@
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal stand-in for the Azure OpenAI chat completions API, for local runs and load tests:
+#   flask ai-stub --port 8089
+#   AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8089/ AZURE_OPENAI_API_KEY=stub gunicorn app:app
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0  # Seconds to wait before answering, like a model generating
+    calls = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        type(self).calls += 1
+        question = next(
+            (part["text"] for message in body.get("messages", []) if isinstance(message.get("content"), list)
+             for part in message["content"] if part.get("type") == "text" and part["text"].startswith("Answer this question:")),
+            "",
+        )
+        answer = f"Stub answer #{self.calls} to: {question[len('Answer this question:'):]}"
+        if body.get("stream"):
+            self.send_stream(body.get("model", "stub"), answer)
+            return
+        self.send_json({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": answer}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(answer.split()), "total_tokens": len(answer.split())},
+        })
+
+    # Chat completion chunks as server-sent events, the delay spread over the words
+    def send_stream(self, model, answer):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = answer.split(" ")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        for index, word in enumerate(words):
+            time.sleep(self.delay / len(words))
+            self.send_event({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": word if index == 0 else " " + word}}],
+            })
+        self.send_event({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}],
+        })
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_event(self, payload):
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def send_json(self, payload):
+        time.sleep(self.delay)
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"ai-stub: {format % args}")
+
+def serve(host, port, delay):
+    StubHandler.delay = delay
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
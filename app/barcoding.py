@@ -0,0 +1,116 @@
+import os
+import tempfile
+from itertools import islice
+from app.lazy import lazy_import
+
+pd = lazy_import("pandas")
+openpyxl = lazy_import("openpyxl")
+
+# Metadata columns identifying one diagram set
+COMBINATION_COLUMNS = ["Location", "Hive", "Date"]
+
+# Taxonomy placeholders such as "g__" or "s__" that carry no real name
+TAXONOMY_PREFIX_PATTERN = r"^[A-Z]__"
+
+chunk_rows = int(os.getenv("BARCODING_CHUNK_ROWS", 5000))  # Rows cleaned at a time
+spool_limit = int(os.getenv("BARCODING_SPOOL_BYTES", 32 * 1024 * 1024))  # Cleaned workbooks beyond this spill to disk
+
+def taxonomy_columns_for(sheet_name):
+    return ["Class", "Genus"] if sheet_name in ["Fungi", "Bacteria"] else ["Class", "Genus", "Species"]
+
+# Sidecar frames are projected and record their sample columns; workbook sheets start them at the 9th column
+def sample_columns_of(barcoding_df):
+    return barcoding_df.attrs.get("sample_columns", barcoding_df.columns[8:])
+
+def clean_sheet(sheet_data):
+    # Filter rows where all sample columns are zero
+    sample_columns = sheet_data.columns[8:]  # Sample columns start from the 9th column
+    sheet_data = sheet_data.loc[
+        ~sheet_data[sample_columns].eq(0).all(axis=1)
+    ]
+    # Remove rows with taxonomy prefixes
+    return sheet_data[
+        ~sheet_data["Genus"].str.contains(TAXONOMY_PREFIX_PATTERN, na=False) &
+        ~sheet_data["Species"].str.contains(TAXONOMY_PREFIX_PATTERN, na=False)
+    ]
+
+def header_of(row):
+    return [f"Unnamed: {index}" if value is None else value for index, value in enumerate(row)]
+
+# Read an xlsx sheet by sheet in read-only mode, yielding row chunks as DataFrames
+def iter_xlsx_chunks(source):
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            rows = worksheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            columns = header_of(header)
+            # Blank rows can never hold a detection
+            rows = (row for row in rows if any(value is not None for value in row))
+            while True:
+                chunk = list(islice(rows, chunk_rows))
+                yield worksheet.title, pd.DataFrame(chunk, columns=columns)
+                if len(chunk) < chunk_rows:
+                    break
+    finally:
+        workbook.close()
+
+# Legacy .xls workbooks cannot be read in streaming mode, so they are parsed one sheet at a time
+def iter_xls_chunks(source):
+    with pd.ExcelFile(source) as workbook:
+        for sheet_name in workbook.sheet_names:
+            yield sheet_name, workbook.parse(sheet_name)
+
+# Clean a barcoding workbook into a spooled xlsx buffer, one row chunk at a time. on_sheet receives every
+# cleaned sheet once it is complete, so with it the cleaned rows of the current sheet are also kept and
+# peak memory follows the largest cleaned sheet rather than the chunk size.
+def clean_barcoding_workbook(source, file_extension, on_sheet=None):
+    output = tempfile.SpooledTemporaryFile(max_size=spool_limit)
+    workbook = openpyxl.Workbook(write_only=True)
+
+    chunks = iter_xlsx_chunks(source) if file_extension == ".xlsx" else iter_xls_chunks(source)
+    current_sheet, worksheet, cleaned = None, None, []
+
+    def finish_sheet():
+        if current_sheet is not None and on_sheet is not None:
+            on_sheet(current_sheet, pd.concat(cleaned, ignore_index=True))
+
+    try:
+        for sheet_name, chunk in chunks:
+            if sheet_name != current_sheet:
+                finish_sheet()
+                current_sheet, cleaned = sheet_name, []
+                worksheet = workbook.create_sheet(title=sheet_name)
+                worksheet.append(list(chunk.columns))
+
+            chunk = clean_sheet(chunk)
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+                worksheet.append(list(row))
+            if on_sheet is not None:
+                cleaned.append(chunk)
+
+        finish_sheet()
+
+        workbook.save(output)
+    except Exception:
+        discard_workbook(workbook)
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+# Write-only sheets stream into temporary files that are only removed by save(), or at interpreter exit
+def discard_workbook(workbook):
+    for worksheet in workbook.worksheets:
+        writer = worksheet._writer
+        if writer is None:
+            continue
+        try:
+            if worksheet._rows is not None:
+                worksheet._rows.close()  # Ends the sheet's row stream before its file goes away
+            writer.close()
+            writer.cleanup()
+        except Exception as e:
+            print(f"Error removing worksheet temp file: {e}")
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# Rendered diagrams are cached per visualization, keyed by the ETags of the source blobs
+cache_dir = os.getenv("VISUALIZATION_CACHE_DIR", "/tmp/edna-visualization-cache")
+memory_limit = int(os.getenv("VISUALIZATION_CACHE_MEMORY_BYTES", 256 * 1024 * 1024))
+disk_limit = int(os.getenv("VISUALIZATION_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+
+
+class DiagramCache:
+    def __init__(self, directory, max_memory_bytes, max_disk_bytes):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # (visualization_id, digest) -> payload bytes
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(etags):
+        return hashlib.sha256("|".join(etags).encode("utf-8")).hexdigest()
+
+    def _path(self, visualization_id, digest):
+        return os.path.join(self.directory, visualization_id, f"{digest}.json")
+
+    def get(self, visualization_id, etags):
+        key = (visualization_id, self.digest(etags))
+
+        # In-process tier
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                return payload
+
+        # Local disk tier, promoted to memory on hit
+        path = self._path(*key)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)  # Keep recently used entries at the back of the disk LRU
+        except OSError:
+            return None
+
+        self._remember(key, payload)
+        return payload
+
+    def set(self, visualization_id, etags, payload):
+        key = (visualization_id, self.digest(etags))
+        self._remember(key, payload)
+
+        path = self._path(*key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so concurrent workers never read a partial entry
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+            self._prune_disk()
+        except OSError as e:
+            print(f"Error writing visualization cache: {e}")
+
+    def invalidate(self, visualization_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == visualization_id]:
+                self._memory_bytes -= len(self._entries.pop(key))
+        shutil.rmtree(os.path.join(self.directory, visualization_id), ignore_errors=True)
+
+    def _remember(self, key, payload):
+        if len(payload) > self.max_memory_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._entries[key] = payload
+            self._memory_bytes += len(payload)
+            # Evict least recently used entries until we fit the memory budget
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _prune_disk(self):
+        prune_directory(self.directory, self.max_disk_bytes)
+
+
+# Small in-process cache whose entries expire after ttl seconds, evicting the least recently used beyond max_entries
+class TTLCache:
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+# Remove the least recently modified files under a directory until it fits max_bytes
+def prune_directory(directory, max_bytes):
+    entries = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+diagram_cache = DiagramCache(cache_dir, memory_limit, disk_limit)
@@ -0,0 +1,264 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import select
+from app.database import db
+from app.metrics import assert_max_queries
+from app import passwords
+from app.ai_stub import serve as serve_ai_stub
+from app.models import Farm, User, Visualization
+from app.sidecar import write_sidecar, sidecar_exists, fetch_sidecar, load_sidecar
+from app.occurrences import occurrence_metadata, occurrence_frame, insert_occurrences, delete_occurrences, has_occurrences
+from app.taxon_index import index_taxa, delete_taxa
+from app.storage import get_container_url, download_file_from_url_with_auth
+from app.lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+def register_commands(app):
+    @app.cli.command("init-db")
+    def init_db():
+        """Create any missing tables and indexes."""
+        db.create_all()
+        # create_all skips tables that already exist, so add indexes declared on them since
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+        click.echo("Database tables are up to date.")
+
+    @app.cli.command("backfill-sidecars")
+    def backfill_sidecars():
+        """Write columnar sidecars for visualization pairs uploaded before they existed."""
+        container_url = get_container_url()
+        for visualization in Visualization.query.all():
+            pair_id = visualization.pair_id
+            barcoding_file_id = visualization.barcoding_file_id
+            if sidecar_exists(pair_id, barcoding_file_id):
+                continue
+
+            barcoding_path = os.path.join("/tmp", f"{barcoding_file_id}.xlsx")
+            try:
+                if not download_file_from_url_with_auth(f"{container_url}/{pair_id}/{barcoding_file_id}.xlsx", barcoding_path):
+                    raise RuntimeError("barcoding workbook could not be downloaded")
+                write_sidecar(pair_id, barcoding_file_id, pd.read_excel(barcoding_path, sheet_name=None))
+                click.echo(f"Wrote sidecar for visualization {visualization.visualization_id}")
+            except Exception as e:
+                click.echo(f"Skipped visualization {visualization.visualization_id}: {e}")
+            finally:
+                if os.path.exists(barcoding_path):
+                    os.remove(barcoding_path)
+
+    @app.cli.command("backfill-occurrences")
+    @click.option("--force", is_flag=True, help="Rebuild the occurrences of pairs that already have them.")
+    def backfill_occurrences(force):
+        """Fill t_taxon_occurrence and the taxon search index for visualization pairs uploaded before they existed."""
+        container_url = get_container_url()
+        for visualization in Visualization.query.all():
+            pair_id = visualization.pair_id
+            barcoding_file_id = visualization.barcoding_file_id
+            if not force and has_occurrences(pair_id):
+                continue
+
+            metadata_path = os.path.join("/tmp", f"{visualization.metadata_file_id}.csv")
+            barcoding_path = os.path.join("/tmp", f"{barcoding_file_id}.xlsx")
+            try:
+                if not download_file_from_url_with_auth(f"{container_url}/{pair_id}/{visualization.metadata_file_id}.csv", metadata_path):
+                    raise RuntimeError("metadata file could not be downloaded")
+                metadata_df = pd.read_csv(metadata_path)
+                metadata = occurrence_metadata(metadata_df)
+                if metadata is None:
+                    raise RuntimeError("metadata file lacks the ESV_ID, Location, Hive or Date column")
+
+                # Prefer the sidecar, falling back to the workbook for pairs without one
+                sidecar_sheets = fetch_sidecar(pair_id, barcoding_file_id)
+                if sidecar_sheets is not None:
+                    all_sheets = load_sidecar(sidecar_sheets, metadata_df)
+                elif download_file_from_url_with_auth(f"{container_url}/{pair_id}/{barcoding_file_id}.xlsx", barcoding_path):
+                    all_sheets = pd.read_excel(barcoding_path, sheet_name=None)
+                else:
+                    raise RuntimeError("barcoding workbook could not be downloaded")
+
+                delete_occurrences(pair_id)
+                delete_taxa(pair_id)
+                rows = 0
+                for sheet_name, sheet_data in all_sheets.items():
+                    occurrences = occurrence_frame(sheet_name, sheet_data, metadata)
+                    rows += insert_occurrences(pair_id, occurrences)
+                    index_taxa(pair_id, visualization.farm_id, sheet_name, occurrences)
+                db.session.commit()
+                click.echo(f"Wrote {rows} occurrences for visualization {visualization.visualization_id}")
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f"Skipped visualization {visualization.visualization_id}: {e}")
+            finally:
+                for path in (metadata_path, barcoding_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    @app.cli.command("load-test")
+    @click.option("--path", "paths", multiple=True, default=["/visualization/visualizations", "/file/files"], help="Endpoint to request; may be repeated.")
+    @click.option("--concurrency", default=16, help="Number of concurrent clients.")
+    @click.option("--requests", "total", default=2000, help="Total number of requests.")
+    @click.option("--seed", default=0, help="Insert this many synthetic visualizations first.")
+    def load_test(paths, concurrency, total, seed):
+        """Hammer listing endpoints in-process against the configured database (SQLite or a local MySQL)."""
+        if seed:
+            db.create_all()
+            now = datetime.utcnow()
+            db.session.add_all([
+                Visualization(pair_id=str(uuid.uuid4()), created_at=now - timedelta(seconds=index))
+                for index in range(seed)
+            ])
+            db.session.commit()
+            click.echo(f"Seeded {seed} visualizations.")
+
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+        remaining = iter(range(total))
+
+        def client_loop():
+            client = app.test_client()
+            while True:
+                with lock:
+                    index = next(remaining, None)
+                if index is None:
+                    return
+                start = time.perf_counter()
+                response = client.get(paths[index % len(paths)])
+                response.get_data()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        click.echo(f"{len(latencies)} requests in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} req/s), statuses {statuses}")
+        click.echo(f"latency p50 {percentile(0.5):.1f}ms p95 {percentile(0.95):.1f}ms p99 {percentile(0.99):.1f}ms")
+        # Pool checkout waits as recorded for /metrics
+        for line in app.test_client().get("/metrics").get_data(as_text=True).splitlines():
+            if line.startswith(("edna_db_pool_checkout_seconds_sum", "edna_db_pool_checkout_seconds_count", "edna_db_pool_timeouts_total")):
+                click.echo(line)
+
+    @app.cli.command("check-queries")
+    def check_queries():
+        """Assert that every listing route stays within its query budget, whatever the number of rows."""
+        client = app.test_client()
+        failures = 0
+        # Per-farm and per-user listings are checked for the first farm and user, or for unknown ids
+        ids = {
+            "farm_id": db.session.execute(select(Farm.farm_id).limit(1)).scalar() or str(uuid.uuid4()),
+            "user_id": db.session.execute(select(User.user_id).limit(1)).scalar() or str(uuid.uuid4()),
+        }
+        db.session.rollback()
+        for path, limit in LISTING_QUERY_BUDGETS.items():
+            path = path.format(**ids)
+            client.get(path).get_data()  # Warm the reference and count caches first
+            try:
+                with assert_max_queries(limit, path) as counter:
+                    client.get(path).get_data()
+                click.echo(f"ok {path}: {counter[0]} queries")
+            except AssertionError as e:
+                failures += 1
+                click.echo(f"FAILED {e}")
+        if failures:
+            raise SystemExit(1)
+
+    @app.cli.command("bench-passwords")
+    @click.option("--method", "methods", multiple=True, help="Werkzeug hash method to compare; defaults to PASSWORD_HASH_METHOD.")
+    @click.option("--logins", default=40, help="Verifications per method.")
+    @click.option("--concurrency", default=8, help="Concurrent logins, as from request threads.")
+    def bench_passwords(methods, logins, concurrency):
+        """Report login verifications per second for each hash cost setting."""
+        click.echo(f"{passwords.verify_workers} hashing processes")
+        for method in methods or [passwords.hash_method]:
+            password_hash = passwords.hash_password("correct horse battery staple", method)
+            remaining = iter(range(logins))
+            lock = threading.Lock()
+
+            def login_loop():
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    passwords.verify_password(password_hash, "correct horse battery staple")
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=login_loop) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            click.echo(f"{method}: {logins / elapsed:.1f} logins/s")
+
+    @app.cli.command("import-time")
+    @click.option("--runs", default=3, help="Fresh interpreters to time; the fastest run is reported.")
+    @click.option("--top", default=15, help="Number of slowest modules to list.")
+    @click.option("--preload", is_flag=True, help="Time startup with PRELOAD_HEAVY_MODULES=1.")
+    @click.option("--budget-ms", default=0, help="Exit non-zero when startup takes longer than this.")
+    def import_time(runs, top, preload, budget_ms):
+        """Measure app startup with python -X importtime."""
+        env = dict(os.environ, PRELOAD_HEAVY_MODULES="1" if preload else "0")
+        best = None
+        for _ in range(runs):
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", "from app import create_app; create_app()"],
+                env=env, capture_output=True, text=True, check=True,
+            )
+            # Lines look like "import time: <self us> | <cumulative us> | <indented module>"
+            modules = []
+            for line in result.stderr.splitlines():
+                if not line.startswith("import time:") or "self [us]" in line:
+                    continue
+                self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+                modules.append((int(cumulative_us), name, int(self_us)))
+            total = sum(self_us for _, _, self_us in modules)
+            if best is None or total < best[0]:
+                best = (total, modules)
+
+        total, modules = best
+        click.echo(f"startup imports: {total / 1000:.0f}ms")
+        for cumulative_us, name, _ in sorted(modules, reverse=True)[:top]:
+            click.echo(f"{cumulative_us / 1000:8.1f}ms {name}")
+        if budget_ms and total / 1000 > budget_ms:
+            click.echo(f"Over the {budget_ms}ms budget")
+            raise SystemExit(1)
+
+    @app.cli.command("ai-stub")
+    @click.option("--host", default="127.0.0.1")
+    @click.option("--port", default=8089)
+    @click.option("--delay", default=1.0, help="Seconds each answer takes.")
+    def ai_stub(host, port, delay):
+        """Serve a local stand-in for Azure OpenAI; point AZURE_OPENAI_ENDPOINT at it."""
+        click.echo(f"Stub Azure OpenAI on http://{host}:{port}/")
+        serve_ai_stub(host, port, delay)
+
+# Statements allowed per request on a warm worker; run check-queries against a database with data in it
+LISTING_QUERY_BUDGETS = {
+    "/user/getFarmers": 1,
+    "/role/roles": 0,
+    "/farm/farms": 0,
+    "/file/files": 1,
+    "/visualization/visualizations": 1,
+    "/visualization/visualizations?count=1": 1,
+    "/visualization/visualizations/farm/{farm_id}": 1,
+    "/visualization/visualizations/user/{user_id}": 1,
+    "/visualization/search?taxon=ap": 1,
+}
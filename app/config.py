@@ -1,14 +1,28 @@
 import os
 from dotenv import load_dotenv
+from app.database import engine_options
 
 load_dotenv()
 
-class Config:
-    SQLALCHEMY_DATABASE_URI = (
+def mysql_uri(host):
+    return (
         f"mysql+pymysql://{os.getenv('DB_USERNAME')}:{os.getenv('DB_PASSWORD')}@"
-        f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}?"
+        f"{host}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}?"
         f"ssl_ca={os.path.join(os.getcwd(), 'ca-cert.pem')}"
     )
 
+class Config:
+    # DATABASE_URL overrides the MySQL server, e.g. sqlite:///edna.db for tests
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL') or mysql_uri(os.getenv('DB_HOST'))
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, "primary")
+
+    # Optional read replica for listing endpoints, given as DATABASE_REPLICA_URL or DB_REPLICA_HOST
+    REPLICA_DATABASE_URI = os.getenv('DATABASE_REPLICA_URL') or (
+        mysql_uri(os.getenv('DB_REPLICA_HOST')) if os.getenv('DB_REPLICA_HOST') else None
+    )
+    SQLALCHEMY_BINDS = {
+        "replica": {"url": REPLICA_DATABASE_URI, **engine_options(REPLICA_DATABASE_URI, "replica")},
+    } if REPLICA_DATABASE_URI else {}
+
     SQLALCHEMY_TRACK_MODIFICATIONS = False  # Disable track modifications for performance
     SECRET_KEY = os.getenv('SECRET_KEY', 'default-secret-key')
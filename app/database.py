@@ -1,3 +1,65 @@
+import os
+import sqlite3
+import time
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from app.metrics import record_pool_checkout
 
 db = SQLAlchemy()
+
+# Queue pool that records how long each checkout waits for a connection, including pre-ping and reconnects
+class TimedQueuePool(QueuePool):
+    def connect(self):
+        pool_name = self._orig_logging_name or "primary"
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            record_pool_checkout(pool_name, time.perf_counter() - start, timed_out=True)
+            raise
+        record_pool_checkout(pool_name, time.perf_counter() - start)
+        return connection
+
+# pysqlite starts transactions lazily and never before a SAVEPOINT, so on SQLite a savepoint
+# (session.begin_nested) outside a begun transaction committed on release. Let SQLAlchemy issue BEGIN itself.
+@event.listens_for(Engine, "connect")
+def sqlite_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.isolation_level = None
+
+@event.listens_for(Engine, "begin")
+def sqlite_begin(connection):
+    if connection.dialect.name == "sqlite":
+        # On the driver connection, so BEGIN is not counted as a query
+        connection.connection.driver_connection.execute("BEGIN")
+
+def env_flag(name, default):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+# Engine options for one database, sized per gunicorn worker
+def engine_options(uri, pool_name):
+    # Checked on the string, since config is imported before any database settings are validated
+    if uri.startswith("sqlite") and (uri.rstrip("/").endswith(":") or ":memory:" in uri):
+        # In-memory SQLite runs on a single static connection
+        return {"pool_logging_name": pool_name}
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_logging_name": pool_name,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        # Recycle well before the server drops idle connections, and test each one on checkout
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 280)),
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", "true"),
+    }
+
+# Listing reads go to the read replica when one is configured, everything else to the primary
+def execute_read(statement):
+    replica = db.engines.get("replica")
+    if replica is None:
+        return db.session.execute(statement)
+    return db.session.execute(statement, bind_arguments={"bind": replica})
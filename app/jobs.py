@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.database import db
+from app.models import Job
+
+# Background jobs run on a small in-process worker pool; their status lives in t_job
+# so any gunicorn worker can answer a status poll
+job_workers = int(os.getenv("JOB_WORKERS", 2))
+executor = ThreadPoolExecutor(max_workers=job_workers, thread_name_prefix="edna-job")
+
+def enqueue_job(job_type, visualization_id, func, *args):
+    job = Job(job_type=job_type, visualization_id=visualization_id, status="queued")
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    executor.submit(run_job, app, job.job_id, func, *args)
+    return job.job_id
+
+def run_job(app, job_id, func, *args):
+    with app.app_context():
+        set_job_status(job_id, "running")
+        try:
+            func(*args)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Job {job_id} failed: {e}")
+            set_job_status(job_id, "failed", error=str(e))
+        else:
+            set_job_status(job_id, "succeeded")
+
+def set_job_status(job_id, status, error=None):
+    job = db.session.get(Job, job_id)
+    if not job:
+        return
+    job.status = status
+    job.error = error
+    db.session.commit()
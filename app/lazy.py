@@ -0,0 +1,34 @@
+import importlib
+import os
+
+# Heavy dependencies (pandas, plotly, pyarrow, openpyxl, the Azure and OpenAI SDKs) are only imported
+# when a route first touches them, so workers boot and answer /health without paying for them.
+_modules = {}
+
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        module = self.__dict__.get("_module")
+        if module is None:
+            # Concurrent first uses are serialized by the import lock
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module {self._name}>"
+
+def lazy_import(name):
+    if name not in _modules:
+        _modules[name] = LazyModule(name)
+    return _modules[name]
+
+# Import everything up front instead, e.g. in the gunicorn master with --preload so forked workers share
+# the loaded modules copy-on-write. Set PRELOAD_HEAVY_MODULES=1 to do this in create_app.
+def preload():
+    for name in list(_modules):
+        importlib.import_module(name)
+
+def preload_enabled():
+    return os.getenv("PRELOAD_HEAVY_MODULES", "").lower() in ("1", "true", "yes")
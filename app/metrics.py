@@ -0,0 +1,248 @@
+import json
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Metrics are kept per process; every gunicorn worker exposes its own on /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+METRIC_HELP = {
+    "edna_request_duration_seconds": ("histogram", "Request latency per endpoint"),
+    "edna_stage_duration_seconds": ("histogram", "Time spent per request in a named processing stage"),
+    "edna_db_queries_total": ("counter", "SQL statements executed"),
+    "edna_db_query_seconds_total": ("counter", "Time spent executing SQL statements"),
+    "edna_blob_bytes_total": ("counter", "Bytes transferred to or from blob storage"),
+    "edna_blob_seconds_total": ("counter", "Time spent transferring blobs"),
+    "edna_peak_rss_growth_bytes_total": ("counter", "Growth of the process peak RSS while serving requests"),
+    "edna_db_pool_checkout_seconds": ("histogram", "Time spent waiting for a pooled database connection"),
+    "edna_db_pool_timeouts_total": ("counter", "Checkouts that gave up waiting for a pooled database connection"),
+    "edna_ai_requests_total": ("counter", "AI analysis requests by how they were answered: hit, coalesced or miss"),
+    "edna_ai_image_bytes_saved_total": ("counter", "Image bytes not sent to the model thanks to downscaling"),
+    "edna_ai_history_tokens_saved_total": ("counter", "Estimated chat history tokens not sent to the model thanks to compaction"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}  # (name, labels) -> value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    # Prometheus text exposition format
+    def render(self):
+        with self._lock:
+            series = {}
+            for (name, labels), histogram in self._histograms.items():
+                lines = series.setdefault(name, [])
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+            for (name, labels), value in self._counters.items():
+                series.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+
+        output = []
+        for name in sorted(series):
+            metric_type, help_text = METRIC_HELP.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(series[name])
+        return "\n".join(output) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+# Breakdown of the request being served, shared with the blob transfer threads it spawns
+class RequestProfile:
+    def __init__(self, blueprint, endpoint):
+        self.blueprint = blueprint
+        self.endpoint = endpoint
+        self.stages = {}
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.blob_bytes = 0
+        self.blob_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def labels(self):
+        return (("blueprint", self.blueprint), ("endpoint", self.endpoint))
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+
+    def add_blob(self, nbytes, seconds):
+        with self._lock:
+            self.blob_bytes += nbytes
+            self.blob_seconds += seconds
+
+
+registry = Registry()
+current_profile = ContextVar("current_profile", default=None)
+query_counters = ContextVar("query_counters", default=())
+
+def current_labels():
+    profile = current_profile.get()
+    return profile.labels if profile else (("blueprint", "none"), ("endpoint", "background"))
+
+# Time a named stage of the current request, e.g. with stage("download"): ...
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add_stage(name, time.perf_counter() - start)
+
+def record_blob(operation, nbytes, seconds):
+    labels = current_labels() + (("operation", operation),)
+    registry.inc("edna_blob_bytes_total", labels, nbytes)
+    registry.inc("edna_blob_seconds_total", labels, seconds)
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add_blob(nbytes, seconds)
+
+def record_pool_checkout(pool_name, seconds, timed_out=False):
+    labels = current_labels() + (("pool", pool_name),)
+    registry.observe("edna_db_pool_checkout_seconds", labels, seconds)
+    if timed_out:
+        registry.inc("edna_db_pool_timeouts_total", labels)
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add_stage("pool_wait", seconds)
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    labels = current_labels()
+    registry.inc("edna_db_queries_total", labels)
+    registry.inc("edna_db_query_seconds_total", labels, elapsed)
+    for counter in query_counters.get():
+        counter[0] += 1
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add_query(elapsed)
+
+# Fail when the block runs more SQL statements than allowed, e.g. to catch N+1 loading on a listing
+@contextmanager
+def assert_max_queries(limit, label="block"):
+    counter = [0]
+    token = query_counters.set(query_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        query_counters.reset(token)
+    if counter[0] > limit:
+        raise AssertionError(f"{label} ran {counter[0]} queries, expected at most {limit}")
+
+def peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ru_maxrss is in KiB on Linux
+
+def start_request():
+    profile = RequestProfile(request.blueprint or "none", request.endpoint or "none")
+    g.profile_token = current_profile.set(profile)
+    g.profile_start = time.perf_counter()
+    g.profile_rss = peak_rss_bytes()
+
+def finish_request(response):
+    profile = current_profile.get()
+    if profile is None or "profile_start" not in g:
+        return response
+
+    elapsed = time.perf_counter() - g.profile_start
+    rss_growth = peak_rss_bytes() - g.profile_rss
+    labels = profile.labels
+    registry.observe("edna_request_duration_seconds", labels + (("method", request.method), ("status", str(response.status_code))), elapsed)
+    for name, seconds in profile.stages.items():
+        registry.observe("edna_stage_duration_seconds", labels + (("stage", name),), seconds)
+    registry.inc("edna_peak_rss_growth_bytes_total", labels, rss_growth)
+
+    # Opt-in breakdown for the caller; streamed bodies are only timed up to the first byte
+    if request.headers.get("X-Profile") == "1":
+        timings = [("total", elapsed), ("db", profile.db_seconds), ("blob", profile.blob_seconds)] + list(profile.stages.items())
+        response.headers["Server-Timing"] = ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
+        response.headers["X-Profile"] = json.dumps({
+            "total_seconds": round(elapsed, 6),
+            "stages": {name: round(seconds, 6) for name, seconds in profile.stages.items()},
+            "db_queries": profile.db_queries,
+            "db_seconds": round(profile.db_seconds, 6),
+            "blob_bytes": profile.blob_bytes,
+            "blob_seconds": round(profile.blob_seconds, 6),
+            "peak_rss_growth_bytes": rss_growth,
+        })
+    return response
+
+def end_request(exception=None):
+    token = g.pop("profile_token", None)
+    if token is not None:
+        try:
+            current_profile.reset(token)
+        except ValueError:
+            # Streamed responses may finish in another context than the one they started in
+            current_profile.set(None)
+
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+_listening = False
+
+def init_metrics(app):
+    global _listening
+    if not _listening:
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        _listening = True
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(end_request)
+    app.add_url_rule("/metrics", "metrics", metrics)
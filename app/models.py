@@ -46,6 +46,15 @@ class File(db.Model):
     farm_id = db.Column(db.String(36), db.ForeignKey('t_farm.farm_id'), nullable=True)  # Foreign key to Farm
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Creation timestamp
 
+    # Composite indexes backing the keyset-paginated file listing and its filters
+    __table_args__ = (
+        db.Index('ix_file_created_at_file_id', 'created_at', 'file_id'),
+        db.Index('ix_file_farm_id_created_at', 'farm_id', 'created_at', 'file_id'),
+        db.Index('ix_file_user_id_created_at', 'user_id', 'created_at', 'file_id'),
+        db.Index('ix_file_pair_id_created_at', 'pair_id', 'created_at', 'file_id'),
+        db.Index('ix_file_file_type_created_at', 'file_type', 'created_at', 'file_id'),
+    )
+
     def __repr__(self):
         return f"<File {self.file_name}>"
 
@@ -97,6 +106,12 @@ class Visualization(db.Model):
     barcoding_file_id = db.Column(db.String(36), nullable=True)
     farm_id = db.Column(db.String(36), db.ForeignKey('t_farm.farm_id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Creation timestamp
+
+    # Composite indexes backing the keyset-paginated visualization listings
+    __table_args__ = (
+        db.Index('ix_visualization_created_at_visualization_id', 'created_at', 'visualization_id'),
+        db.Index('ix_visualization_farm_id_created_at', 'farm_id', 'created_at', 'visualization_id'),
+    )
     
     def __repr__(self):
         return f"<Visualization {self.file_name}>"
@@ -108,6 +123,86 @@ class VisualizationPermisson(db.Model):
     visualization_id = db.Column(db.String(36), db.ForeignKey('t_visualization.visualization_id'), nullable=False)
     user_id = db.Column(db.String(36), db.ForeignKey('t_user.user_id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Creation timestamp
+
+    # Lets the per-user listing find a user's grants without touching the permission rows
+    __table_args__ = (
+        db.Index('ix_visualization_permission_user_id', 'user_id', 'visualization_id'),
+    )
     
     def __repr__(self):
-        return f"<VisualizationPermission {self.visualization_permission_id}>"
\ No newline at end of file
+        return f"<VisualizationPermission {self.visualization_permission_id}>"
+class Job(db.Model):
+    __tablename__ = 't_job'
+
+    job_id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))  # CHAR(36) for UUID
+    job_type = db.Column(db.String(64), nullable=False)  # Job type, e.g. render_pair
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, succeeded or failed
+    visualization_id = db.Column(db.String(36), db.ForeignKey('t_visualization.visualization_id', ondelete='CASCADE'), nullable=True)
+    error = db.Column(db.Text, nullable=True)  # Error message of a failed job
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Creation timestamp
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)  # Last status change
+
+    def __repr__(self):
+        return f"<Job {self.job_id} {self.status}>"
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "job_type": self.job_type,
+            "status": self.status,
+            "visualization_id": self.visualization_id,
+            "error": self.error,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S") if self.created_at else None,
+            "updated_at": self.updated_at.strftime("%Y-%m-%d %H:%M:%S") if self.updated_at else None,
+        }
+
+class TaxonOccurrence(db.Model):
+    __tablename__ = 't_taxon_occurrence'
+
+    # One row per detection: a taxon present in a sample of a pair's barcoding sheet, with the sample's metadata
+    occurrence_id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)  # Auto-incrementing primary key
+    pair_id = db.Column(db.String(36), nullable=False)  # Pair of the barcoding file
+    sheet_name = db.Column(db.String(64), nullable=False)  # Barcoding sheet, e.g. Bacteria (Excel allows 31 characters)
+    esv_id = db.Column(db.String(255), nullable=False)  # Sample column, matched to the metadata ESV_ID
+    taxon_class = db.Column('class', db.String(255), nullable=True)
+    genus = db.Column(db.String(255), nullable=True)
+    species = db.Column(db.String(255), nullable=True)  # Not recorded for Fungi and Bacteria
+    presence = db.Column(db.Float, nullable=False)  # Value of the sample column, always above zero
+    location = db.Column(db.String(255), nullable=True)  # Metadata Location (farm)
+    hive = db.Column(db.String(255), nullable=True)  # Metadata Hive
+    date = db.Column(db.String(255), nullable=True)  # Metadata Date, as written in the metadata file
+
+    # Diagram sets aggregate a pair by sheet; analytics look genera and species up across pairs.
+    # Keys stay under InnoDB's 3072-byte limit with utf8mb4 (4 bytes per character).
+    __table_args__ = (
+        db.Index('ix_taxon_occurrence_pair_id_sheet_name', 'pair_id', 'sheet_name'),
+        db.Index('ix_taxon_occurrence_genus_species', 'genus', 'species'),
+    )
+
+    def __repr__(self):
+        return f"<TaxonOccurrence {self.occurrence_id}>"
+
+class TaxonIndex(db.Model):
+    __tablename__ = 't_taxon_index'
+
+    # Inverted index for taxon search: detections of a genus or species per pair and farm, hive and date
+    taxon_index_id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)  # Auto-incrementing primary key
+    taxon_key = db.Column(db.String(255), nullable=False)  # Lowercased taxon name, matched by prefix
+    taxon_name = db.Column(db.String(255), nullable=False)  # Taxon name as written in the barcoding sheet
+    taxon_rank = db.Column(db.String(16), nullable=False)  # genus or species
+    sheet_name = db.Column(db.String(255), nullable=False)  # Barcoding sheet, e.g. Insects
+    farm_id = db.Column(db.String(36), nullable=True)  # Farm the pair was uploaded for
+    pair_id = db.Column(db.String(36), nullable=False)
+    location = db.Column(db.String(255), nullable=True)  # Metadata Location
+    hive = db.Column(db.String(255), nullable=True)  # Metadata Hive
+    date = db.Column(db.String(255), nullable=True)  # Metadata Date
+    count = db.Column(db.Integer, nullable=False)  # Samples the taxon was detected in
+
+    # Prefix searches are range scans on taxon_key; deleting a pair removes its entries by pair_id
+    __table_args__ = (
+        db.Index('ix_taxon_index_taxon_key', 'taxon_key', 'date'),
+        db.Index('ix_taxon_index_pair_id', 'pair_id'),
+    )
+
+    def __repr__(self):
+        return f"<TaxonIndex {self.taxon_name}>"
@@ -0,0 +1,80 @@
+import os
+from sqlalchemy import insert, delete, exists, select
+from app.barcoding import taxonomy_columns_for, sample_columns_of
+from app.database import db
+from app.lazy import lazy_import
+from app.models import TaxonOccurrence
+from app.taxon_index import index_taxa
+
+pd = lazy_import("pandas")
+
+# Cleaned barcoding sheets are also stored melted in t_taxon_occurrence, so questions about what was
+# detected where can be answered with SQL instead of downloading and parsing the workbooks
+batch_rows = int(os.getenv("OCCURRENCE_BATCH_ROWS", 5000))  # Rows sent per executemany
+
+TAXONOMY_FIELDS = {"Class": "taxon_class", "Genus": "genus", "Species": "species"}
+METADATA_FIELDS = {"ESV_ID": "esv_id", "Location": "location", "Hive": "hive", "Date": "date"}
+
+# The metadata columns occurrences are joined on, as text the way they appear in combination keys;
+# None when the metadata file lacks any of them, in which case no occurrences are recorded
+def occurrence_metadata(metadata_df):
+    missing = [column for column in METADATA_FIELDS if column not in metadata_df.columns]
+    if missing:
+        print(f"Error preparing occurrences: metadata has no {', '.join(missing)} column")
+        return None
+    metadata = metadata_df[list(METADATA_FIELDS)].drop_duplicates(subset="ESV_ID")
+    return metadata.astype(str).where(metadata.notna(), None)
+
+# Melt a sheet to one row per detection, joined with the metadata row (from occurrence_metadata) of its sample
+def occurrence_frame(sheet_name, barcoding_df, metadata):
+    taxonomy_columns = taxonomy_columns_for(sheet_name)
+    melted = barcoding_df.melt(
+        id_vars=taxonomy_columns,
+        value_vars=sample_columns_of(barcoding_df),
+        var_name="Sample",
+        value_name="Presence",
+    )
+    # Text in a sample cell, e.g. "n/a", is not a detection
+    melted["Presence"] = pd.to_numeric(melted["Presence"], errors="coerce")
+    melted = melted[melted["Presence"] > 0]
+
+    merged = melted.astype({"Sample": str}).merge(metadata, left_on="Sample", right_on="ESV_ID", how="inner")
+
+    frame = merged[taxonomy_columns + list(METADATA_FIELDS)].rename(columns={**TAXONOMY_FIELDS, **METADATA_FIELDS})
+    frame["presence"] = merged["Presence"].astype(float)
+    frame["sheet_name"] = sheet_name
+    return frame.astype(object).where(frame.notna(), None)
+
+# Occurrences are a derived copy, so a sheet they cannot be read from is skipped rather than failing the upload
+def sheet_occurrences(sheet_name, barcoding_df, metadata):
+    try:
+        return occurrence_frame(sheet_name, barcoding_df, metadata)
+    except Exception as e:
+        print(f"Error deriving occurrences of sheet {sheet_name}: {e}")
+        return None
+
+# Bulk insert the detections of one sheet (an occurrence_frame) in executemany batches, inside the caller's transaction
+def insert_occurrences(pair_id, occurrences):
+    rows = occurrences.assign(pair_id=pair_id).to_dict("records")
+    statement = insert(TaxonOccurrence)
+    for start in range(0, len(rows), batch_rows):
+        db.session.execute(statement, rows[start:start + batch_rows])
+    return len(rows)
+
+# Insert a sheet's occurrences and taxon index entries in a savepoint of the caller's transaction.
+# A sheet the database rejects, e.g. a name too long for its column, is rolled back and skipped.
+def record_occurrences(pair_id, farm_id, sheet_name, occurrences):
+    try:
+        with db.session.begin_nested():
+            insert_occurrences(pair_id, occurrences)
+            index_taxa(pair_id, farm_id, sheet_name, occurrences)
+    except Exception as e:
+        print(f"Error recording occurrences of sheet {sheet_name}: {e}")
+        return False
+    return True
+
+def delete_occurrences(pair_id):
+    db.session.execute(delete(TaxonOccurrence.__table__).where(TaxonOccurrence.pair_id == pair_id))
+
+def has_occurrences(pair_id):
+    return db.session.execute(select(exists().where(TaxonOccurrence.pair_id == pair_id))).scalar()
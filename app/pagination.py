@@ -0,0 +1,65 @@
+import base64
+import json
+from datetime import datetime
+from urllib.parse import urlencode
+from flask import current_app, request, stream_with_context
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def parse_limit():
+    limit = request.args.get("limit", type=int) or DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+# Cursors are opaque to clients: the (created_at, id) of the last row of a page
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat(), row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+# Newest first, continuing strictly after the cursor, so every page is an index range scan
+def keyset_page(query, created_column, id_column, cursor, limit):
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(or_(
+            created_column < created_at,
+            and_(created_column == created_at, id_column < row_id),
+        ))
+    return query.order_by(created_column.desc(), id_column.desc()).limit(limit)
+
+def parse_fields(allowed):
+    fields = request.args.get("fields")
+    if not fields:
+        return list(allowed)
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+# Encode a JSON array one element at a time instead of building the whole document
+def stream_json_array(items):
+    def generate():
+        yield "["
+        for index, item in enumerate(items):
+            yield ("," if index else "") + current_app.json.dumps(item)
+        yield "]"
+
+    return stream_with_context(generate())
+
+# A page of rows as a streamed JSON array; the cursor of the next page goes in the X-Next-Cursor and Link headers
+def page_response(items, next_cursor):
+    response = current_app.response_class(stream_json_array(items), status=200, mimetype="application/json")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
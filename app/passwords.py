@@ -0,0 +1,42 @@
+import os
+from functools import lru_cache
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+from app.metrics import stage
+from app.processes import ProcessPool
+
+# Werkzeug method string setting the hash cost, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Stored hashes made with other parameters are upgraded on the next successful login.
+hash_method = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+# Hashing runs in a few worker processes, so a burst of logins holds neither the GIL of the
+# request workers nor more than this many CPUs per gunicorn worker; 0 hashes on the request thread
+verify_workers = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+
+pool = ProcessPool(verify_workers, start_method="spawn")
+
+def run_hashing(func, *args):
+    if verify_workers <= 0:
+        return func(*args)
+    try:
+        return pool.get().submit(func, *args).result()
+    except BrokenProcessPool:
+        # A hashing process died, e.g. out of memory; retry once on a fresh pool
+        pool.reset()
+        return pool.get().submit(func, *args).result()
+
+def hash_password(password, method=None):
+    with stage("password_hash"):
+        return run_hashing(generate_password_hash, password, method or hash_method)
+
+def verify_password(password_hash, password):
+    with stage("password_verify"):
+        return run_hashing(check_password_hash, password_hash, password)
+
+# Short forms such as "scrypt" are stored with their default parameters spelled out
+@lru_cache(maxsize=None)
+def stored_method(method):
+    return generate_password_hash("", method).split("$", 1)[0]
+
+def needs_rehash(password_hash):
+    return password_hash.split("$", 1)[0] != stored_method(hash_method)
@@ -0,0 +1,46 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# CPU-bound work runs on process pools rather than on the threaded workers. Figure rendering uses a fork
+# server that has plotly loaded; the fork server reads its preload list only when it starts, so the list
+# is set here, once, before any pool is created. Password hashing needs none of that and uses spawned
+# processes instead, so a first login neither starts the fork server nor loads pandas and plotly.
+# Scripts using these pools need a __main__ guard.
+FORKSERVER_PRELOAD = ["app.rendering", "plotly.express", "plotly.io"]
+
+_lock = threading.Lock()
+_contexts = {}
+
+def get_context(start_method):
+    with _lock:
+        if start_method not in _contexts:
+            context = multiprocessing.get_context(start_method)
+            if start_method == "forkserver":
+                context.set_forkserver_preload(FORKSERVER_PRELOAD)
+            _contexts[start_method] = context
+        return _contexts[start_method]
+
+# A lazily started ProcessPoolExecutor. A pool inherited through fork (gunicorn --preload) belongs
+# to the parent, so each process starts its own.
+class ProcessPool:
+    def __init__(self, max_workers, start_method="forkserver"):
+        self.max_workers = max_workers
+        self.start_method = start_method
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def get(self):
+        context = get_context(self.start_method)
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+                self._pid = os.getpid()
+            return self._executor
+
+    # Drop a broken pool; the next get starts a fresh one
+    def reset(self):
+        with self._lock:
+            self._executor = None
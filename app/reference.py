@@ -0,0 +1,53 @@
+import os
+from sqlalchemy import select
+from app.cache import TTLCache
+from app.database import db
+from app.models import Farm, Role
+
+# Roles and farms change rarely, so each worker keeps a snapshot of them. Writes made through this
+# worker invalidate it right away; the TTL bounds how long other workers serve a stale snapshot.
+reference_cache = TTLCache(int(os.getenv("REFERENCE_CACHE_TTL_SECONDS", 300)))
+
+
+class Snapshot:
+    def __init__(self, rows):
+        self.rows = rows  # [(id, name)] in table order
+        self.by_id = dict(rows)
+        self.by_name = {name: row_id for row_id, name in rows}
+
+
+def roles():
+    return reference_cache.get_or_set("roles", lambda: Snapshot([
+        tuple(row) for row in db.session.execute(select(Role.role_id, Role.role_name))
+    ]))
+
+def farms():
+    return reference_cache.get_or_set("farms", lambda: Snapshot([
+        tuple(row) for row in db.session.execute(select(Farm.farm_id, Farm.farm_name))
+    ]))
+
+def role_name(role_id):
+    return lookup(roles, "roles", role_id)
+
+def farm_name(farm_id):
+    return lookup(farms, "farms", farm_id)
+
+def role_id_by_name(name):
+    role_id = roles().by_name.get(name)
+    if role_id is None:
+        reference_cache.invalidate("roles")
+        role_id = roles().by_name.get(name)
+    return role_id
+
+# An id missing from the snapshot may have been created by another worker, so reload once before giving up
+def lookup(snapshot, key, row_id):
+    if row_id is None:
+        return None
+    name = snapshot().by_id.get(row_id)
+    if name is None:
+        reference_cache.invalidate(key)
+        name = snapshot().by_id.get(row_id)
+    return name
+
+def invalidate_farms():
+    reference_cache.invalidate("farms")
@@ -0,0 +1,187 @@
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from app.barcoding import COMBINATION_COLUMNS, taxonomy_columns_for, sample_columns_of
+from app.cache import diagram_cache, TTLCache
+from app.metrics import stage
+from app.processes import ProcessPool
+from app.sidecar import fetch_sidecar, load_sidecar
+from app.lazy import lazy_import
+
+px = lazy_import("plotly.express")
+pio = lazy_import("plotly.io")  # For serializing plotly figures
+
+# Figures are built and serialized on a pool of processes, one (sheet, farm, hive, date) unit per figure.
+# Only each unit's aggregated counts are sent to the pool; the parsed frames stay in the request process.
+# RENDER_WORKERS=0 renders on the request thread.
+render_workers = int(os.getenv("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+render_deadline = float(os.getenv("RENDER_DEADLINE_SECONDS", 120))
+render_tasks_per_worker = 4  # Units are sent in batches; a few batches per worker keeps them all busy
+
+render_pool = ProcessPool(render_workers)  # Its fork server preloads plotly (see app.processes)
+
+def combination_key(location, hive, date):
+    return f"{location}-{hive}-{date}"
+
+# Melt and merge a sheet once, then count detections for every farm, hive, date and taxon in one groupby
+def aggregate_sheet(sheet_name, barcoding_df, metadata_df):
+    taxonomy_columns = taxonomy_columns_for(sheet_name)
+    sample_columns = sample_columns_of(barcoding_df)
+
+    melted = barcoding_df.melt(
+        id_vars=taxonomy_columns,
+        value_vars=sample_columns,
+        var_name="Sample",
+        value_name="Presence",
+    )
+    melted = melted[melted["Presence"] > 0]
+
+    # Sidecar sample columns are strings while numeric ESV_IDs parse as integers, so both sides compare as text
+    metadata = metadata_df.dropna(subset=COMBINATION_COLUMNS)[["ESV_ID"] + COMBINATION_COLUMNS].astype({"ESV_ID": str})
+    merged = melted.astype({"Sample": str}).merge(metadata, left_on="Sample", right_on="ESV_ID", how="inner")
+
+    counts = (
+        merged.groupby(COMBINATION_COLUMNS + taxonomy_columns, observed=True)
+        .size()
+        .reset_index(name="Count")
+    )
+    # Dictionary-encoded sidecar columns come back as categoricals; the figures want plain labels
+    return counts.astype({column: object for column in taxonomy_columns})
+
+# Aggregated counts of every sheet, by sheet name
+def aggregate_sheets(metadata_df, all_sheets):
+    sheet_counts = {}
+    for sheet_name, sheet_data in all_sheets.items():
+        with stage("aggregate"):
+            sheet_counts[sheet_name] = aggregate_sheet(sheet_name, sheet_data, metadata_df)
+    return sheet_counts
+
+# Aggregated counts keep per visualization for slicing; keyed by visualization_id with the source ETags alongside
+counts_cache = TTLCache(int(os.getenv("COUNTS_CACHE_TTL_SECONDS", 900)), int(os.getenv("COUNTS_CACHE_MAX_ENTRIES", 32)))
+
+def get_cached_counts(visualization_id, etags):
+    entry = counts_cache.get(visualization_id)
+    if entry is not None and entry[0] == etags:
+        return entry[1]
+    return None
+
+def set_cached_counts(visualization_id, etags, sheet_counts):
+    counts_cache.set(visualization_id, (list(etags), sheet_counts))
+
+# Restrict the counts to one farm (Location), hive, date and/or sheet; values compare as they appear in combination keys
+def slice_counts(sheet_counts, farm=None, hive=None, date=None, sheet=None):
+    filters = [(column, value) for column, value in zip(COMBINATION_COLUMNS, (farm, hive, date)) if value is not None]
+    sliced = {}
+    for sheet_name, counts in sheet_counts.items():
+        if sheet is not None and sheet_name != sheet:
+            continue
+        for column, value in filters:
+            counts = counts[counts[column].astype(str) == value]
+        sliced[sheet_name] = counts
+    return sliced
+
+# Aggregated counts by combination key, then by sheet
+def group_counts(sheet_counts):
+    grouped = {}
+    for sheet_name, counts in sheet_counts.items():
+        for combination, sunburst_data in counts.groupby(COMBINATION_COLUMNS, sort=False):
+            grouped.setdefault(combination_key(*combination), {})[sheet_name] = sunburst_data
+    return grouped
+
+# Yield the serialized diagrams of every farm, hive and date combination that has data
+def iter_diagrams(sheet_counts):
+    deadline = time.monotonic() + render_deadline
+    grouped = group_counts(sheet_counts)
+
+    units = [(key, sheet_name, sunburst_data) for key, sheets in grouped.items() for sheet_name, sunburst_data in sheets.items()]
+    if render_workers <= 0 or len(units) < 2:
+        yield from render_serially(grouped, deadline)
+    else:
+        yield from render_in_pool(grouped, units, deadline)
+
+def render_serially(grouped, deadline):
+    for key, sheets in grouped.items():
+        diagrams = {}
+        for sheet_name, sunburst_data in sheets.items():
+            check_deadline(deadline)
+            with stage("figure"):
+                fig = process_sheet(sheet_name, sunburst_data)
+            with stage("serialize"):
+                diagrams[sheet_name] = pio.to_json(fig)
+        yield key, diagrams
+
+# Batches are contiguous runs of units, so combinations complete in order and can be yielded as they do
+def render_in_pool(grouped, units, deadline):
+    batch_size = max(1, len(units) // (render_workers * render_tasks_per_worker))
+    try:
+        executor = render_pool.get()
+        futures = [executor.submit(render_units, units[start:start + batch_size]) for start in range(0, len(units), batch_size)]
+    except BrokenProcessPool:
+        render_pool.reset()
+        raise
+
+    diagrams = {}
+    try:
+        for future in futures:
+            with stage("render"):
+                rendered = future.result(timeout=max(0, deadline - time.monotonic()))
+            for key, sheet_name, diagram in rendered:
+                diagrams.setdefault(key, {})[sheet_name] = diagram
+                if len(diagrams[key]) == len(grouped[key]):
+                    yield key, diagrams.pop(key)
+    except TimeoutError:
+        raise TimeoutError(f"Rendering took longer than {render_deadline:g} seconds")
+    except BrokenProcessPool:
+        # A render process died, e.g. out of memory; the next request starts a fresh pool
+        render_pool.reset()
+        raise
+    finally:
+        # Units not started yet are dropped once the request gives up on them
+        for future in futures:
+            future.cancel()
+
+def check_deadline(deadline):
+    if time.monotonic() > deadline:
+        raise TimeoutError(f"Rendering took longer than {render_deadline:g} seconds")
+
+# Runs in a render process
+def render_units(units):
+    return [(key, sheet_name, pio.to_json(process_sheet(sheet_name, sunburst_data))) for key, sheet_name, sunburst_data in units]
+
+# Generate sunburst diagrams for all combinations of farm, hive, and date
+def render_diagrams(sheet_counts):
+    return dict(iter_diagrams(sheet_counts))
+
+# Serialize the diagrams the same way getVisualization responds with them
+def render_payload(sheet_counts):
+    all_diagrams = render_diagrams(sheet_counts)
+    with stage("encode"):
+        return current_app.json.dumps({"diagrams": all_diagrams}).encode("utf-8")
+
+# Background job: render a freshly uploaded pair from its sidecar so its first view is served from the cache
+def render_pair(visualization_id, etags, metadata_df, pair_id, barcoding_file_id):
+    sidecar_sheets = fetch_sidecar(pair_id, barcoding_file_id)
+    if sidecar_sheets is None:
+        raise RuntimeError("The pair has no sidecar to render from")
+    sheet_counts = aggregate_sheets(metadata_df, load_sidecar(sidecar_sheets, metadata_df))
+    set_cached_counts(visualization_id, etags, sheet_counts)
+    diagram_cache.set(visualization_id, etags, render_payload(sheet_counts))
+
+# Function to generate a sunburst diagram from the aggregated counts of one combination
+def process_sheet(sheet_name, sunburst_data):
+    taxonomy_columns = taxonomy_columns_for(sheet_name)
+
+    # Hover labels show the combination the counts belong to
+    sunburst_data = sunburst_data.astype({column: str for column in COMBINATION_COLUMNS})
+
+    fig = px.sunburst(
+        sunburst_data,
+        path=taxonomy_columns,
+        values="Count",
+        hover_data={"Hive": True, "Location": True, "Date": True, "Count": False},
+        title=f"Taxonomy Sunburst for {sheet_name}",
+    )
+    fig.update_layout(autosize=True, margin=dict(t=50, l=0, r=0, b=0), height=None)
+
+    return fig
@@ -1,9 +1,10 @@
 import uuid
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token
-from app.models import User, Farm, Role
+from app.models import User
 from app.database import db
+from app.reference import role_name, farm_name
+from app.passwords import hash_password, verify_password, needs_rehash
 import pytz
 from datetime import datetime
 
@@ -26,7 +27,7 @@ def signup():
     user_id = str(uuid.uuid4())
 
     # Hash the password
-    hashed_password = generate_password_hash(data['password'])
+    hashed_password = hash_password(data['password'])
 
     melbourne_tz = pytz.timezone('Australia/Melbourne')
     melbourne_time = datetime.now(melbourne_tz)
@@ -67,14 +68,23 @@ def signin():
     user = User.query.filter_by(email=email).first()
 
     # Validate user existence and password
-    if not user or not check_password_hash(user.password_hash, password):
+    if not user or not verify_password(user.password_hash, password):
         return jsonify({"message": "Invalid email or password"}), 401
 
+    # Upgrade hashes made with older cost parameters while the password is at hand
+    if needs_rehash(user.password_hash):
+        try:
+            user.password_hash = hash_password(password)
+            db.session.commit()
+        except Exception as e:
+            print(f"Error rehashing password: {e}")
+            db.session.rollback()
+
     # Create a JWT token for the user
     access_token = create_access_token(identity=user.user_id)
     
-    role = Role.query.filter_by(role_id=user.role_id).first()
-    farm = Farm.query.filter_by(farm_id=user.farm_id).first()
+    # Role and farm names come from the reference cache, so the user lookup is the only query
+    user_role_name = role_name(user.role_id)
 
     # Return success response with user details and JWT token
     return jsonify({
@@ -84,10 +94,10 @@ def signin():
             "user_id": user.user_id,
             "username": user.username,
             "email": user.email,
-            "role_id": role.role_name,
-            "role_name": role.role_name,
+            "role_id": user_role_name,
+            "role_name": user_role_name,
             "farm_id": user.farm_id,
-            "farm_name": farm.farm_name if farm else None
+            "farm_name": farm_name(user.farm_id)
         }
     }), 200
     
@@ -4,13 +4,13 @@ import uuid
 import pytz
 from datetime import datetime
 from app.database import db
+from app.reference import farms, invalidate_farms
 
 farm_bp = Blueprint('farm', __name__)
 
 @farm_bp.route('/farms', methods=['GET'])
 def getFarms():
-    farms = Farm.query.all()
-    return jsonify([{"farm_id": farm.farm_id, "farm_name": farm.farm_name} for farm in farms]), 200
+    return jsonify([{"farm_id": farm_id, "farm_name": farm_name} for farm_id, farm_name in farms().rows]), 200
 
 @farm_bp.route('/create', methods=['POST'])
 def createFarm():
@@ -43,6 +43,7 @@ def createFarm():
     try:
         db.session.add(new_farm)
         db.session.commit()
+        invalidate_farms()
         return jsonify({"farm_id": farm_id, "farm_name": farm_name}), 201
     except Exception as e:
         db.session.rollback()
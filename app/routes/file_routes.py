@@ -1,20 +1,36 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, current_app, stream_with_context
 from app.models import File
 from app.models import Visualization
 from app.models import VisualizationPermisson
-from app.database import db
-from azure.storage.blob import BlobClient
+from app.models import Job
+from app.database import db, execute_read
+from app.metrics import stage
+from app.pagination import parse_fields, parse_limit, keyset_page, encode_cursor, page_response
+from app.cache import diagram_cache
+from app.jobs import enqueue_job
+from app.rendering import render_pair, counts_cache
+from app.barcoding import clean_barcoding_workbook
+from app.sidecar import SidecarWriter
+from app.occurrences import occurrence_metadata, sheet_occurrences, record_occurrences, delete_occurrences
+from app.taxon_index import delete_taxa
+from app.lazy import lazy_import
+from app.storage import submit, get_blob_properties, iter_blob_chunks, upload_blob, delete_blob_prefix
 import os
+from concurrent.futures import wait
+from urllib.parse import urlparse
+from werkzeug.http import unquote_etag
 from werkzeug.utils import secure_filename
 import uuid
-from azure.storage.blob import BlobServiceClient
 from datetime import datetime
 from dotenv import load_dotenv
-import pandas as pd
 import pytz
+from sqlalchemy import select
 
 load_dotenv()
 
+pd = lazy_import("pandas")
+azure_exceptions = lazy_import("azure.core.exceptions")
+
 file_bp = Blueprint('file', __name__)
 
 # Read all files or a specific file by ID
@@ -37,20 +53,34 @@ def get_files():
             "created_at": file.created_at.isoformat(),
         })
     else:
-        files = File.query.all()
-        return jsonify([
-            {
-                "file_id": file.file_id,
-                "pair_id": file.pair_id,
-                "hive_giai": file.hive_giai,
-                "file_type": file.file_type,
-                "file_name": file.file_name,
-                "file_url": file.file_url,
-                "user_id": file.user_id,
-                "farm_id": file.farm_id,
-                "created_at": file.created_at.isoformat(),
-            } for file in files
-        ])
+        # Keyset-paginated listing, newest first
+        try:
+            fields = parse_fields(FILE_FIELDS)
+            limit = parse_limit()
+            # The cursor columns are always loaded, even when not requested
+            columns = fields + [field for field in ["file_id", "created_at"] if field not in fields]
+            query = select(*[getattr(File, field) for field in columns])
+            for field in FILE_FILTERS:
+                value = request.args.get(field)
+                if value:
+                    query = query.where(getattr(File, field) == value)
+            query = keyset_page(query, File.created_at, File.file_id, request.args.get("cursor"), limit)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+
+        rows = execute_read(query).all()
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].file_id) if len(rows) == limit else None
+        return page_response(
+            ({field: serialize_file_field(row, field) for field in fields} for row in rows),
+            next_cursor,
+        )
+
+FILE_FIELDS = ["file_id", "pair_id", "hive_giai", "file_type", "file_name", "file_url", "user_id", "farm_id", "created_at"]
+FILE_FILTERS = ["farm_id", "user_id", "pair_id", "file_type"]
+
+def serialize_file_field(row, field):
+    value = getattr(row, field)
+    return value.isoformat() if field == "created_at" else value
 
 # Update a file by ID
 @file_bp.route('/files/<file_id>', methods=['PUT'])
@@ -60,6 +90,9 @@ def update_file(file_id):
     if not file:
         return jsonify({"message": "File not found"}), 404
 
+    # Drop cached diagrams of the pair this file belongs to
+    invalidate_pair_diagrams(file.pair_id)
+
     # Update fields if provided in the request
     if "pair_id" in data:
         file.pair_id = data["pair_id"]
@@ -76,6 +109,9 @@ def update_file(file_id):
     if "farm_id" in data:
         file.farm_id = data["farm_id"]
 
+    # The file may have been moved to another pair
+    invalidate_pair_diagrams(file.pair_id)
+
     db.session.commit()
     return jsonify({"message": "File updated successfully"})
 
@@ -91,26 +127,23 @@ def delete_file(file_id):
     # Also delete visualization record
     visualization = Visualization.query.filter_by(pair_id=file.pair_id).first()
     if visualization:
+        diagram_cache.invalidate(visualization.visualization_id)
+        counts_cache.invalidate(visualization.visualization_id)
         db.session.delete(visualization)
+        delete_occurrences(file.pair_id)
+        delete_taxa(file.pair_id)
         
     db.session.commit()
     return jsonify({"message": "File deleted successfully"})
 
-account_name = os.getenv("AZURE_STORAGE_ACCOUNT_NAME")
-account_key = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
-container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
+def invalidate_pair_diagrams(pair_id):
+    if not pair_id:
+        return
+    for visualization in Visualization.query.filter_by(pair_id=pair_id).all():
+        diagram_cache.invalidate(visualization.visualization_id)
+        counts_cache.invalidate(visualization.visualization_id)
 
-def download_file_from_url_with_auth(blob_url, download_file_path):
-    try:
-        blob_client = BlobClient.from_blob_url(blob_url, credential=account_key)
-        with open(download_file_path, "wb") as file:
-            file.write(blob_client.download_blob().readall())
-        return download_file_path
-    except Exception as e:
-        print(f"Error during download: {e}")
-        return None
-
-# Download a file from Azure Blob Storage
+# Download a file from Azure Blob Storage, streamed through to the client
 @file_bp.route("/download", methods=["POST"])
 def download_file():
     data = request.json
@@ -119,31 +152,51 @@ def download_file():
     if not blob_url:
         return jsonify({"error": "Blob URL is required"}), 400
 
-    # Define the temporary file path
-    temp_file_path = os.path.join("/tmp", os.path.basename(blob_url)).replace("\\", "/")
-    
-    # Ensure the temp directory exists
-    os.makedirs(os.path.dirname(temp_file_path), exist_ok=True)
-
-    # Print the download path for debugging
-    print(f"Downloading file to: {temp_file_path}")
-    
-    # Download the file
-    downloaded_file = download_file_from_url_with_auth(blob_url, temp_file_path)
-
-    if downloaded_file:
-        # Ensure the file exists before sending
-        if os.path.exists(downloaded_file):
-            # Send the file as an attachment, which triggers the download in the browser
-            return send_file(downloaded_file, as_attachment=True, download_name=os.path.basename(downloaded_file))
-        else:
-            return jsonify({"error": "Downloaded file not found"}), 500
-    else:
+    try:
+        properties = get_blob_properties(blob_url)
+    except azure_exceptions.ResourceNotFoundError:
+        return jsonify({"error": "File not found"}), 404
+    except Exception as e:
+        print(f"Error during download: {e}")
         return jsonify({"error": "Failed to download file"}), 500
 
-connection_string = f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
-blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-container_client = blob_service_client.get_container_client(container_name)
+    etag, _ = unquote_etag(properties.etag)
+    size = properties.size
+
+    # The browser already has this version of the file
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    # Serve a single byte range when asked to, unless If-Range names another version. Multiple ranges
+    # are not supported, so those requests get the whole file, as RFC 9110 allows.
+    start, stop = 0, size
+    status = 200
+    if request.range and len(request.range.ranges) == 1 and ("If-Range" not in request.headers or request.if_range.etag == etag):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response = current_app.response_class(status=416)
+            response.headers["Content-Range"] = f"bytes */{size}"
+            return response
+        start, stop = byte_range
+        status = 206
+
+    chunks = iter_blob_chunks(blob_url, offset=start, length=stop - start, etag=properties.etag) if stop > start else []
+
+    response = current_app.response_class(
+        stream_with_context(chunks),
+        status=status,
+        mimetype=properties.content_settings.content_type or "application/octet-stream",
+    )
+    response.content_length = stop - start
+    response.accept_ranges = "bytes"
+    response.set_etag(etag)
+    if status == 206:
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    download_name = os.path.basename(urlparse(blob_url).path)
+    response.headers.set("Content-Disposition", "attachment", filename=download_name)
+    return response
 
 # Upload files to Azure Blob Storage and save file records to the database
 @file_bp.route("/upload", methods=["POST"])
@@ -163,90 +216,134 @@ def upload_files():
         # Generate pair_id for the two files
         pair_id = str(uuid.uuid4())
 
-        # Handle file uploads
-        uploaded_files = []
+        # Validate both files before anything is uploaded
+        files = {}
         for file, file_type in [(metadata_file, "metadata"), (barcoding_file, "barcoding")]:
-            file_id = str(uuid.uuid4())
-            
-            # distinguish metadata and barcoding files id
-            if file_type == "metadata":
-                metadata_file_id = file_id
-            else:
-                barcoding_file_id = file_id
             filename = secure_filename(file.filename)
             file_extension = os.path.splitext(filename)[1]  # Extract the file extension
 
             if not file_extension:  # Validate file extension
                 return jsonify({"error": f"File {filename} has no extension."}), 400
 
-            file_path = f"{pair_id}/{file_id}{file_extension}"
-            blob_client = container_client.get_blob_client(file_path)
-
-            # Clean data if file is barcoding
-            if file_type == "barcoding":
-                if file_extension in [".xls", ".xlsx"]:
-                    df = pd.read_excel(file, sheet_name=None)  # Load all sheets
-                    # Remove rows with taxonomy prefixes
-                    taxonomy_prefix_pattern = r"^[A-Z]__"
-                    for sheet_name, sheet_data in df.items():
-                        # Filter rows where all sample columns are zero
-                        sample_columns = sheet_data.columns[8:]  # Sample columns start from the 9th column
-                        sheet_data = sheet_data.loc[
-                            ~sheet_data[sample_columns].eq(0).all(axis=1)
-                        ]
-                        # Remove rows with taxonomy prefixes
-                        df[sheet_name] = sheet_data[
-                            ~sheet_data["Genus"].str.contains(taxonomy_prefix_pattern, na=False) &
-                            ~sheet_data["Species"].str.contains(taxonomy_prefix_pattern, na=False)
-                        ]
-                    # Save the cleaned data back to the file before uploading
-                    cleaned_file_path = f"/tmp/{file_id}_cleaned.xlsx"
-                    with pd.ExcelWriter(cleaned_file_path) as writer:
-                        for sheet_name, sheet_data in df.items():
-                            sheet_data.to_excel(writer, sheet_name=sheet_name, index=False)
-                    file = open(cleaned_file_path, "rb")  # Use cleaned file for upload
-
-            # Upload file to Azure Blob Storage
-            blob_client.upload_blob(file, overwrite=True)
-            file_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{file_path}"
-            
+            file_id = str(uuid.uuid4())
+            files[file_type] = {
+                "file_id": file_id,
+                "file_name": filename,
+                "file_extension": file_extension,
+                "file_path": f"{pair_id}/{file_id}{file_extension}",
+            }
+
+        metadata_file_id = files["metadata"]["file_id"]
+        barcoding_file_id = files["barcoding"]["file_id"]
+
+        metadata_upload = None
+        try:
+            # Keep the parsed metadata so the diagrams can be rendered without downloading it again.
+            # Only the pre-rendering and occurrences use it, so a file pandas cannot parse is still uploaded.
+            metadata_df = None
+            if files["metadata"]["file_extension"] == ".csv":
+                try:
+                    metadata_df = pd.read_csv(metadata_file)
+                except Exception as e:
+                    print(f"Error parsing metadata: {e}")
+                metadata_file.seek(0)
+
+            # Upload the metadata while the barcoding file is being cleaned
+            metadata_upload = submit(upload_blob, files["metadata"]["file_path"], metadata_file)
+
+            # Clean data if file is barcoding, streaming the cleaned workbook into a spooled buffer
+            barcoding_data = barcoding_file
+            has_sidecar = False
+            if files["barcoding"]["file_extension"] in [".xls", ".xlsx"]:
+                # Columnar copy of the cleaned sheets, read by the visualizations instead of the workbook
+                sidecar = SidecarWriter(pair_id, barcoding_file_id)
+
+                # Detections go into t_taxon_occurrence and the taxon search index in the same transaction as the file records
+                metadata = occurrence_metadata(metadata_df) if metadata_df is not None else None
+
+                def on_sheet(sheet_name, sheet_data):
+                    sidecar.add_sheet(sheet_name, sheet_data)
+                    if metadata is None:
+                        return
+                    with stage("occurrences"):
+                        occurrences = sheet_occurrences(sheet_name, sheet_data, metadata)
+                        if occurrences is not None:
+                            record_occurrences(pair_id, farm_id, sheet_name, occurrences)
+
+                barcoding_data = clean_barcoding_workbook(barcoding_file, files["barcoding"]["file_extension"], on_sheet=on_sheet)
+                has_sidecar = sidecar.close()
+
+            try:
+                barcoding_blob, barcoding_result = upload_blob(files["barcoding"]["file_path"], barcoding_data)
+            finally:
+                barcoding_data.close()
+            metadata_blob, metadata_result = metadata_upload.result()
+
+            etags = {"metadata": metadata_result.get("etag"), "barcoding": barcoding_result.get("etag")}
+            files["metadata"]["file_url"] = metadata_blob.url
+            files["barcoding"]["file_url"] = barcoding_blob.url
+
             melbourne_tz = pytz.timezone('Australia/Melbourne')
             melbourne_time = datetime.now(melbourne_tz)
 
-            # Save file record to the database
-            new_file = File(
-                file_id=file_id,
-                pair_id=pair_id,
-                hive_giai=hive_giai,
-                file_type=file_type,
-                file_name=filename,
-                file_url=file_url,
-                user_id=user_id,
-                farm_id=farm_id,
-                created_at=melbourne_time
-            )
-            db.session.add(new_file)
-            uploaded_files.append({
-                "file_id": file_id,
-                "file_type": file_type,
-                "file_name": filename,
-                "file_url": file_url,
-            })
-        
-        # also add to table t_visualization
-        visualization_id = str(uuid.uuid4())
-        new_visualization = Visualization(visualization_id=visualization_id, pair_id=pair_id, farm_id=farm_id, metadata_file_id=metadata_file_id, barcoding_file_id=barcoding_file_id)
-        db.session.add(new_visualization)
-        
-        # also add to table t_visualization_permission
-        new_visualization_permission = VisualizationPermisson(visualization_id=visualization_id, user_id=user_id)
-        db.session.add(new_visualization_permission)
-   
-        db.session.commit()
+            # Save file records to the database only once both uploads succeeded
+            uploaded_files = []
+            for file_type, uploaded in files.items():
+                new_file = File(
+                    file_id=uploaded["file_id"],
+                    pair_id=pair_id,
+                    hive_giai=hive_giai,
+                    file_type=file_type,
+                    file_name=uploaded["file_name"],
+                    file_url=uploaded["file_url"],
+                    user_id=user_id,
+                    farm_id=farm_id,
+                    created_at=melbourne_time
+                )
+                db.session.add(new_file)
+                uploaded_files.append({
+                    "file_id": uploaded["file_id"],
+                    "file_type": file_type,
+                    "file_name": uploaded["file_name"],
+                    "file_url": uploaded["file_url"],
+                })
+
+            # also add to table t_visualization
+            visualization_id = str(uuid.uuid4())
+            new_visualization = Visualization(visualization_id=visualization_id, pair_id=pair_id, farm_id=farm_id, metadata_file_id=metadata_file_id, barcoding_file_id=barcoding_file_id)
+            db.session.add(new_visualization)
+
+            # also add to table t_visualization_permission
+            new_visualization_permission = VisualizationPermisson(visualization_id=visualization_id, user_id=user_id)
+            db.session.add(new_visualization_permission)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Remove whatever part of the pair already reached blob storage
+            if metadata_upload is not None:
+                wait([metadata_upload])
+            delete_blob_prefix(f"{pair_id}/")
+            raise
+
+        # Render the diagrams in the background while the client moves on. The pair is committed by now,
+        # so a failure here only costs the pre-rendering; the first view renders the diagrams instead.
+        job_id = None
+        if metadata_df is not None and has_sidecar and all(etags.values()):
+            try:
+                job_id = enqueue_job(
+                    "render_pair", visualization_id, render_pair,
+                    visualization_id, [etags["metadata"], etags["barcoding"]], metadata_df, pair_id, barcoding_file_id,
+                )
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error enqueuing render job: {e}")
 
         return jsonify({
             "message": "Files uploaded successfully.",
             "uploaded_files": uploaded_files,
+            "visualization_id": visualization_id,
+            "job_id": job_id,
         }), 200
 
     except Exception as e:
@@ -254,3 +351,10 @@ def upload_files():
         
         return jsonify({"error": "An error occurred during file upload."}), 500
 
+# Poll the status of a background job
+@file_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
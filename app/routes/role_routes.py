@@ -1,9 +1,8 @@
 from flask import Blueprint, jsonify
-from app.models import Role
+from app.reference import roles
 
 role_bp = Blueprint('role', __name__)
 
 @role_bp.route('/roles', methods=['GET'])
 def getRoles():
-    roles = Role.query.all()
-    return jsonify([{"id": role.role_id, "name": role.role_name} for role in roles]), 200
\ No newline at end of file
+    return jsonify([{"id": role_id, "name": role_name} for role_id, role_name in roles().rows]), 200
\ No newline at end of file
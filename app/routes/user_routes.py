@@ -1,8 +1,10 @@
 import uuid
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from app.models import User, Role
+from app.models import User
 from app.database import db
+from app.reference import role_id_by_name
+from app.serialization import USER_SHAPE
+from app.passwords import hash_password, verify_password
 
 user_bp = Blueprint('user', __name__)
 
@@ -51,10 +53,10 @@ def changePassword():
     if not user:
         return jsonify({"message": "User not found"}), 404
 
-    if not check_password_hash(user.password_hash, current_password):
+    if not verify_password(user.password_hash, current_password):
         return jsonify({"message": "Current password is incorrect"}), 403
 
-    user.password_hash = generate_password_hash(new_password)
+    user.password_hash = hash_password(new_password)
 
     try:
         db.session.commit()
@@ -66,10 +68,11 @@ def changePassword():
 # get all farmers
 @user_bp.route('/getFarmers', methods=['GET'])
 def getFarmers():
-    roleId = Role.query.filter_by(role_name='Farmer').first().role_id
+    roleId = role_id_by_name('Farmer')
     
-    farms = User.query.filter_by(role_id=roleId).all()
+    # Plain column tuples, serialized like User.to_dict
+    farms = USER_SHAPE.all(db.session, USER_SHAPE.select().where(User.role_id == roleId))
     if not farms:
         return jsonify({"message": "No farmers found"}), 404
       
-    return jsonify([farm.to_dict() for farm in farms]), 200
\ No newline at end of file
+    return jsonify(farms), 200
\ No newline at end of file
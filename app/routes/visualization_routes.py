@@ -1,46 +1,99 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, stream_with_context
 from app.models import Visualization
 from app.models import VisualizationPermisson
-from azure.storage.blob import BlobClient
+from app.ai import ask, stream_ask
+from app.cache import diagram_cache, TTLCache
+from app.metrics import stage
+from app.pagination import parse_limit, keyset_page, encode_cursor, page_response
+from app.rendering import render_payload, iter_diagrams, aggregate_sheets, slice_counts, get_cached_counts, set_cached_counts
+from app.barcoding import COMBINATION_COLUMNS
+from app.sunburst import render_lean_payload, iter_lean_diagrams, shared_layout
+from app.taxon_index import search_taxa, search_limit
+from app.sidecar import fetch_sidecar, load_sidecar, sidecar_sheet_names
+from app.lazy import lazy_import
+from app.storage import submit, get_container_url, get_blob_etag, get_blob_etags, read_blob, download_file_from_url_with_auth
+import io
 import os
-from app.database import db
-import pandas as pd
-import plotly.express as px
-import plotly.io as pio  # For serializing plotly figures
-import base64
+from app.database import db, execute_read
+import json
 from mimetypes import guess_type
-from openai import AzureOpenAI
+from sqlalchemy import select, func
 
-account_key = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
-container_url = "https://edna0912.blob.core.windows.net/container0912"
+pd = lazy_import("pandas")
+azure_exceptions = lazy_import("azure.core.exceptions")
 
 visualization_bp = Blueprint('visualization', __name__)
 
 @visualization_bp.route('/visualizations', methods=['GET'])
 def getVisualizations():
-    visualizations = Visualization.query.all()
-    return jsonify([{"id": visualization.visualization_id, "metadata_file_id": visualization.metadata_file_id, "barcoding_file_id": visualization.barcoding_file_id, "pair_id": visualization.pair_id, "created_at": visualization.created_at} for visualization in visualizations]), 200
+    return list_visualizations(select(*VISUALIZATION_COLUMNS), ("all",))
 
 # get visualization by farm_id
 @visualization_bp.route('/visualizations/farm/<farm_id>', methods=['GET'])
 def getVisualizationsByFarmId(farm_id):
-    visualizations = Visualization.query.filter_by(farm_id=farm_id).all()
-    
-    return jsonify([{"id": visualization.visualization_id, "metadata_file_id": visualization.metadata_file_id, "barcoding_file_id": visualization.barcoding_file_id, "pair_id": visualization.pair_id, "created_at": visualization.created_at} for visualization in visualizations]), 200
+    query = select(*VISUALIZATION_COLUMNS).where(Visualization.farm_id == farm_id)
+    return list_visualizations(query, ("farm", farm_id))
 
 # get visualization by user_id
 @visualization_bp.route('/visualizations/user/<user_id>', methods=['GET'])
 def getVisualizationsByUserId(user_id):
-    visualizationPermissons = VisualizationPermisson.query.filter_by(user_id=user_id).all()
-    
-    visualizations = Visualization.query.filter(Visualization.visualization_id.in_([visualizationPermisson.visualization_id for visualizationPermisson in visualizationPermissons])).all()
-    
-    return jsonify([{"id": visualization.visualization_id, "metadata_file_id": visualization.metadata_file_id, "barcoding_file_id": visualization.barcoding_file_id, "pair_id": visualization.pair_id, "created_at": visualization.created_at} for visualization in visualizations]), 200
+    # One joined query; distinct guards against a visualization being granted to the same user twice
+    query = (
+        select(*VISUALIZATION_COLUMNS)
+        .join(VisualizationPermisson, VisualizationPermisson.visualization_id == Visualization.visualization_id)
+        .where(VisualizationPermisson.user_id == user_id)
+        .distinct()
+    )
+    return list_visualizations(query, ("user", user_id))
+
+VISUALIZATION_COLUMNS = [
+    Visualization.visualization_id,
+    Visualization.metadata_file_id,
+    Visualization.barcoding_file_id,
+    Visualization.pair_id,
+    Visualization.created_at,
+]
+
+# Totals are only computed on request (?count=1) and kept for a short while, since they cost a full index scan
+visualization_counts = TTLCache(int(os.getenv("VISUALIZATION_COUNT_TTL_SECONDS", 60)))
+
+# Facets of a visualization with the metadata ETag they were read from
+visualization_facets = TTLCache(int(os.getenv("VISUALIZATION_FACETS_TTL_SECONDS", 900)))
+
+# Keyset-paginated listing, newest first
+def list_visualizations(query, count_key):
+    try:
+        limit = parse_limit()
+        page = keyset_page(query, Visualization.created_at, Visualization.visualization_id, request.args.get("cursor"), limit)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    rows = execute_read(page).all()
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].visualization_id) if len(rows) == limit else None
+    response = page_response(
+        ({"id": row.visualization_id, "metadata_file_id": row.metadata_file_id, "barcoding_file_id": row.barcoding_file_id, "pair_id": row.pair_id, "created_at": row.created_at} for row in rows),
+        next_cursor,
+    )
+    if request.args.get("count") == "1":
+        total = visualization_counts.get_or_set(
+            count_key,
+            lambda: execute_read(select(func.count()).select_from(query.subquery())).scalar(),
+        )
+        response.headers["X-Total-Count"] = str(total)
+    return response
 
 
 @visualization_bp.route('/visualizations/<visualization_id>', methods=['GET'])
 def getVisualization(visualization_id):
     print(f"Fetching visualization with ID: {visualization_id}")
+
+    # format=lean sends bare sunburst traces with one shared layout, optionally pruned to the top/min_count leaves
+    lean = request.args.get("format") == "lean"
+    top = request.args.get("top", type=int)
+    min_count = request.args.get("min_count", type=int)
+    if (top is not None and top <= 0) or (min_count is not None and min_count <= 0):
+        return jsonify({"message": "top and min_count must be positive integers"}), 400
+
     # Query the visualization from the database
     visualization = Visualization.query.filter_by(visualization_id=visualization_id).first()
     if not visualization:
@@ -51,104 +104,169 @@ def getVisualization(visualization_id):
     barcoding_file_id = visualization.barcoding_file_id
 
     # Construct Azure Blob URLs
+    container_url = get_container_url()
     metadata_blob_url = f"{container_url}/{pair_id}/{metadata_file_id}.csv"
     barcoding_blob_url = f"{container_url}/{pair_id}/{barcoding_file_id}.xlsx"
 
+    # Serve from the diagram cache when the source blobs have not changed
+    with stage("etag"):
+        etags = get_blob_etags([metadata_blob_url, barcoding_blob_url])
+    cacheable = all(etags)
+    stream = request.args.get("stream") == "1"
+
+    # farm, hive, date and sheet select a slice; only the diagrams in it are rendered
+    slice_args = {name: request.args.get(name) for name in ("farm", "hive", "date", "sheet")}
+    sliced = any(value is not None for value in slice_args.values())
+
+    # Every variant of the response is cached under its own key
+    variant = []
+    if lean:
+        variant.append(f"lean:{top}:{min_count}")
+    if sliced:
+        variant.append("slice:" + json.dumps(slice_args, sort_keys=True))
+    payload_etags = etags + variant
+
+    if cacheable:
+        cached = diagram_cache.get(visualization_id, payload_etags)
+        if cached is not None:
+            if stream:
+                cached = json.loads(cached)
+                return stream_diagrams(cached["diagrams"].items(), cached.get("layout"))
+            return current_app.response_class(cached, status=200, mimetype="application/json")
+
+    # Slices and other variants reuse the aggregated counts of an earlier request. Without them, a sheet
+    # slice loads and aggregates that sheet only, and its counts are not kept as the pair's.
+    sheet_counts = get_cached_counts(visualization_id, etags) if cacheable else None
+    if sheet_counts is None:
+        sheet = slice_args["sheet"]
+        sheet_counts = aggregate_sheets(*load_frames(pair_id, metadata_file_id, barcoding_file_id, metadata_blob_url, barcoding_blob_url, sheet))
+        if cacheable and sheet is None:
+            set_cached_counts(visualization_id, etags, sheet_counts)
+    if sliced:
+        sheet_counts = slice_counts(sheet_counts, **slice_args)
+
+    # Render and flush one farm-hive-date diagram set at a time
+    if stream:
+        if lean:
+            return stream_diagrams(iter_lean_diagrams(sheet_counts, top, min_count), shared_layout())
+        return stream_diagrams(iter_diagrams(sheet_counts))
+
+    # Generate diagrams for all combinations of farm, hive, and date
+    try:
+        if lean:
+            payload = render_lean_payload(sheet_counts, top, min_count)
+        else:
+            payload = render_payload(sheet_counts)
+    except TimeoutError as e:
+        return jsonify({"message": str(e)}), 504
+    if cacheable:
+        diagram_cache.set(visualization_id, payload_etags, payload)
+
+    return current_app.response_class(payload, status=200, mimetype="application/json")
+
+# Download and parse the metadata and barcoding data of a pair, only the given sheet of it when sheet is set
+def load_frames(pair_id, metadata_file_id, barcoding_file_id, metadata_blob_url, barcoding_blob_url, sheet=None):
     # Define temporary paths for downloaded files
     metadata_temp_path = os.path.join("/tmp", f"{metadata_file_id}.csv").replace("\\", "/")
     barcoding_temp_path = os.path.join("/tmp", f"{barcoding_file_id}.xlsx").replace("\\", "/")
 
-    # Download the files
-    download_file_from_url_with_auth(metadata_blob_url, metadata_temp_path)
-    download_file_from_url_with_auth(barcoding_blob_url, barcoding_temp_path)
+    # Download the metadata while the barcoding data is fetched
+    metadata_download = submit(download_file_from_url_with_auth, metadata_blob_url, metadata_temp_path)
+
+    # Prefer the columnar sidecar, falling back to the workbook for older pairs
+    with stage("download"):
+        sidecar_sheets = fetch_sidecar(pair_id, barcoding_file_id, sheet)
+        if sidecar_sheets is None:
+            download_file_from_url_with_auth(barcoding_blob_url, barcoding_temp_path)
+        metadata_download.result()
 
     # Load metadata and barcoding data
-    metadata_df = pd.read_csv(metadata_temp_path)
-    all_sheets = pd.read_excel(barcoding_temp_path, sheet_name=None)
-    
-    # Generate diagrams for all combinations of farm, hive, and date
-    farms = metadata_df["Location"].dropna().unique()
-    hives = metadata_df["Hive"].dropna().unique()
-    dates = metadata_df["Date"].dropna().unique()
-
-    # Generate sunburst diagrams for all sheets
-    all_diagrams = {}
-    for farm in farms:
-        for hive in hives:
-            for date in dates:
-                diagrams = {}
-                for sheet_name, sheet_data in all_sheets.items():
-                    fig = process_sheet(sheet_name, sheet_data, metadata_df, farm, hive, date)
-                    if fig:
-                        diagrams[sheet_name] = pio.to_json(fig)
-                all_diagrams[f"{farm}-{hive}-{date}"] = diagrams
-
-    return jsonify({"diagrams": all_diagrams}), 200
-       
-def download_file_from_url_with_auth(blob_url, download_file_path):
+    with stage("parse"):
+        metadata_df = pd.read_csv(metadata_temp_path)
+        if sidecar_sheets is not None:
+            all_sheets = load_sidecar(sidecar_sheets, metadata_df)
+        elif sheet is not None:
+            with pd.ExcelFile(barcoding_temp_path) as workbook:
+                all_sheets = {sheet: workbook.parse(sheet)} if sheet in workbook.sheet_names else {}
+        else:
+            all_sheets = pd.read_excel(barcoding_temp_path, sheet_name=None)
+    return metadata_df, all_sheets
+
+# Farm, hive, date and sheet values a visualization can be sliced by, read from the metadata file and sidecar manifest only
+@visualization_bp.route('/visualizations/<visualization_id>/facets', methods=['GET'])
+def getVisualizationFacets(visualization_id):
+    visualization = Visualization.query.filter_by(visualization_id=visualization_id).first()
+    if not visualization:
+        return jsonify({"message": "Visualization not found"}), 404
+
+    pair_id = visualization.pair_id
+    metadata_blob_name = f"{pair_id}/{visualization.metadata_file_id}.csv"
+    with stage("etag"):
+        etag = get_blob_etag(f"{get_container_url()}/{metadata_blob_name}")
+
+    cached = visualization_facets.get(visualization_id)
+    if cached is not None and etag is not None and cached[0] == etag:
+        return jsonify(cached[1]), 200
+
     try:
-        blob_client = BlobClient.from_blob_url(blob_url, credential=account_key)
-        
-        # blob_data = blob_client.download_blob().readall()
-        
-        with open(download_file_path, "wb") as file:
-            file.write(blob_client.download_blob().readall())
-            
-        return download_file_path
+        with stage("download"):
+            metadata_bytes = read_blob(metadata_blob_name)
+            sheets = sidecar_sheet_names(pair_id, visualization.barcoding_file_id)
+    except azure_exceptions.ResourceNotFoundError:
+        return jsonify({"message": "Visualization files not found"}), 404
     except Exception as e:
-        print(f"Error during download: {e}")
-        return None
-    
-# Function to process a single sheet and generate a sunburst diagram
-def process_sheet(sheet_name, barcoding_df, metadata_df, selected_location, selected_hive, selected_date):
-    taxonomy_columns = ["Class", "Genus"] if sheet_name in ["Fungi", "Bacteria"] else ["Class", "Genus", "Species"]
-    sample_columns = barcoding_df.columns[8:]
-
-    # Filter metadata
-    filtered_metadata = metadata_df[
-        (metadata_df["Location"] == selected_location) &
-        (metadata_df["Hive"] == selected_hive) &
-        (metadata_df["Date"] == selected_date)
-    ]
-    
-    # print(f"Filtered Metadata:\n{filtered_metadata.head()}")
+        # Blob storage failed or could not be reached
+        print(f"Error reading facets: {e}")
+        return jsonify({"message": "Failed to read visualization files"}), 502
 
-    melted_bacteria = barcoding_df.melt(
-        id_vars=taxonomy_columns,
-        value_vars=sample_columns,
-        var_name="Sample",
-        value_name="Presence",
-    )
+    with stage("parse"):
+        metadata_df = pd.read_csv(io.BytesIO(metadata_bytes), usecols=lambda column: column in COMBINATION_COLUMNS)
+        combinations = metadata_df.dropna(subset=COMBINATION_COLUMNS).drop_duplicates().astype(str)
 
-    merged_data = melted_bacteria.merge(
-        filtered_metadata, left_on="Sample", right_on="ESV_ID", how="inner"
-    )
-
-    filtered_data = merged_data[merged_data["Presence"] > 0]
-    
-    sunburst_data = (
-        filtered_data.groupby(taxonomy_columns)
-        .agg(
-            Count=("Presence", lambda x: (x > 0).sum()),
-            Hive=("Hive", lambda x: ", ".join(x.dropna().astype(str).unique())),
-            Location=("Location", lambda x: ", ".join(x.dropna().astype(str).unique())),
-            Date=("Date", lambda x: ", ".join(x.dropna().astype(str).unique())),
-        )
-        .reset_index()
-    )
+    facets = {
+        "farms": sorted(combinations["Location"].unique().tolist()),
+        "hives": sorted(combinations["Hive"].unique().tolist()),
+        "dates": sorted(combinations["Date"].unique().tolist()),
+        "sheets": sheets,  # None for pairs uploaded before sidecars
+        "combinations": [{"farm": location, "hive": hive, "date": date} for location, hive, date in combinations[COMBINATION_COLUMNS].itertuples(index=False)],
+    }
+    if etag is not None:
+        visualization_facets.set(visualization_id, (etag, facets))
+    return jsonify(facets), 200
 
-    fig = px.sunburst(
-        sunburst_data,
-        path=taxonomy_columns,
-        values="Count",
-        hover_data={"Hive": True, "Location": True, "Date": True, "Count": False},
-        title=f"Taxonomy Sunburst for {sheet_name}",
-    )
-    fig.update_layout(autosize=True, margin=dict(t=50, l=0, r=0, b=0), height=None)
+# Send diagram sets as newline-delimited JSON so the client can paint them as they arrive;
+# a shared layout, if any, goes on the first line
+def stream_diagrams(diagram_sets, layout=None):
+    def generate():
+        if layout is not None:
+            yield current_app.json.dumps({"layout": layout}) + "\n"
+        try:
+            for key, diagrams in diagram_sets:
+                yield current_app.json.dumps({"key": key, "diagrams": diagrams}) + "\n"
+        except TimeoutError as e:
+            # Headers are gone already, so the client learns about the deadline from the last line
+            yield current_app.json.dumps({"error": str(e)}) + "\n"
 
-    return fig
+    return current_app.response_class(stream_with_context(generate()), status=200, mimetype="application/x-ndjson")
+       
+# Where a genus or species was detected across all uploads; taxon matches name prefixes, ignoring case
+@visualization_bp.route('/search', methods=['GET'])
+def searchTaxon():
+    taxon = (request.args.get("taxon") or "").strip()
+    if len(taxon) < 2:
+        return jsonify({"message": "taxon must be at least 2 characters"}), 400
 
-azure_open_ai_key = os.getenv("AZURE_OPENAI_API_KEY")
+    limit = max(1, min(request.args.get("limit", type=int) or search_limit, search_limit))
+    with stage("search"):
+        rows = search_taxa(taxon, limit)
+    return jsonify({
+        "results": [
+            {"taxon": row.taxon_name, "rank": row.taxon_rank, "sheet": row.sheet_name, "farm_id": row.farm_id, "pair_id": row.pair_id,
+             "location": row.location, "hive": row.hive, "date": row.date, "count": row.count}
+            for row in rows
+        ],
+        "truncated": len(rows) == limit,
+    }), 200
 
 @visualization_bp.route('/ai', methods=['POST'])
 def ai_analysis():
@@ -161,46 +279,40 @@ def ai_analysis():
         image_file = request.files['image']
         question = request.form['question']
         chatHistory = request.form['chatHistory']
-
-        # Read and encode the image file into a data URL
         mime_type = image_file.mimetype or 'application/octet-stream'
-        base64_encoded_data = base64.b64encode(image_file.read()).decode('utf-8')
-        data_url = f"data:{mime_type};base64,{base64_encoded_data}"
-
-        # Initialize Azure OpenAI client
-        client = AzureOpenAI(
-            api_key=azure_open_ai_key,
-            api_version="2024-05-01-preview",
-            azure_endpoint="https://openai1012.openai.azure.com/"
-        )
 
-        # Specify the model deployment name
-        deployment_name = "gpt-4o"  # Replace with your deployment name
-
-        # Send a request to Azure OpenAI
-        response = client.chat.completions.create(
-            model=deployment_name,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant helping people answer questions related to the image. Please provide an answer to the question in plain text."},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Chat history FYI:" + chatHistory},
-                        {"type": "text", "text": "Answer this question:" + question},
-                        {"type": "image_url", "image_url": {"url": data_url}}
-                    ]
-                }
-            ],
-            max_tokens=2000
-        )
+        # Server-sent events relay the answer as it is generated
+        if request.args.get("stream") == "1" or request.accept_mimetypes.best == "text/event-stream":
+            return stream_ai_answer(stream_ask(image_file.read(), mime_type, question, chatHistory))
 
-        # Extract and return the AI's response
-        ai_response = response.choices[0].message.content
-        return jsonify({"response": ai_response}), 200
+        # Repeated questions about the same chart are answered from the cache
+        ai_response, source = ask(image_file.read(), mime_type, question, chatHistory)
+        response = jsonify({"response": ai_response})
+        response.headers["X-Cache"] = source
+        return response, 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+# Each piece of the answer is a "data" event; a final "done" event carries the whole answer
+def stream_ai_answer(pieces):
+    def generate():
+        parts = []
+        try:
+            for piece in pieces:
+                parts.append(piece)
+                yield f"data: {json.dumps({'delta': piece})}\n\n"
+        except Exception as e:
+            print(f"Error streaming AI answer: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'response': ''.join(parts)})}\n\n"
+
+    response = current_app.response_class(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Keep proxies from buffering the stream
+    return response
+
 @visualization_bp.route('/assign-permission', methods=['POST'])
 def assign_permission():
     data = request.get_json()
@@ -214,5 +326,6 @@ def assign_permission():
     
     db.session.add(visualization_permission)
     db.session.commit()
+    visualization_counts.invalidate(("user", farmer_id))
     
     return jsonify({"message": "Permission assigned successfully"}), 201
@@ -0,0 +1,36 @@
+from datetime import datetime
+from operator import attrgetter
+from sqlalchemy import select
+from app.models import User
+
+# A shape declares the columns a listing returns; they are loaded as plain row tuples,
+# without building ORM objects, and serialized by output name
+class Shape:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields  # output name -> column attribute
+        self.getters = {name: attrgetter(path) for name, path in fields.items()}
+
+    def select(self):
+        return select(*[getattr(self.model, path) for path in self.fields.values()])
+
+    def serialize(self, row):
+        return {name: format_value(getter(row)) for name, getter in self.getters.items()}
+
+    def all(self, session, query=None):
+        rows = session.execute(query if query is not None else self.select()).all()
+        return [self.serialize(row) for row in rows]
+
+def format_value(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime) else value
+
+
+# Same fields as User.to_dict
+USER_SHAPE = Shape(User, {
+    "user_id": "user_id",
+    "username": "username",
+    "role_id": "role_id",
+    "email": "email",
+    "created_at": "created_at",
+    "farm_id": "farm_id",
+})
@@ -0,0 +1,136 @@
+import json
+import os
+from app.barcoding import COMBINATION_COLUMNS, taxonomy_columns_for
+from app.cache import prune_directory
+from app.lazy import lazy_import
+from app.storage import get_container_client, get_container_url, download_files, read_blob, upload_blob
+
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+azure_exceptions = lazy_import("azure.core.exceptions")
+
+# The cleaned barcoding workbook gets a columnar sidecar next to it in blob storage:
+#   {pair_id}/{barcoding_file_id}.sidecar/manifest.json
+#   {pair_id}/{barcoding_file_id}.sidecar/{index}.parquet  (one file per sheet)
+# Sidecar files are also kept in a local directory so they can be memory-mapped.
+sidecar_dir = os.getenv("SIDECAR_DIR", "/tmp/edna-sidecars")
+sidecar_disk_limit = int(os.getenv("SIDECAR_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+
+def sidecar_prefix(pair_id, barcoding_file_id):
+    return f"{pair_id}/{barcoding_file_id}.sidecar"
+
+# Write one Parquet file per sheet, with the taxonomy columns dictionary-encoded, as sheets come in
+class SidecarWriter:
+    def __init__(self, pair_id, barcoding_file_id):
+        self.prefix = sidecar_prefix(pair_id, barcoding_file_id)
+        self.local_dir = os.path.join(sidecar_dir, self.prefix)
+        self.manifest = {"version": 1, "sheets": []}
+        self.failed = False
+
+    def add_sheet(self, sheet_name, sheet_data):
+        if self.failed:
+            return
+        try:
+            taxonomy_columns = [column for column in taxonomy_columns_for(sheet_name) if column in sheet_data.columns]
+            sheet_data = sheet_data.astype({column: "category" for column in taxonomy_columns})
+            sheet_data.columns = [str(column) for column in sheet_data.columns]
+
+            blob_name = f"{len(self.manifest['sheets'])}.parquet"
+            local_path = os.path.join(self.local_dir, blob_name)
+            os.makedirs(self.local_dir, exist_ok=True)
+            temp_path = f"{local_path}.{os.getpid()}.tmp"
+            pq.write_table(pa.Table.from_pandas(sheet_data, preserve_index=False), temp_path)
+            os.replace(temp_path, local_path)
+
+            with open(local_path, "rb") as f:
+                upload_blob(f"{self.prefix}/{blob_name}", f)
+            self.manifest["sheets"].append({"name": sheet_name, "blob": blob_name})
+        except Exception as e:
+            # The workbook stays usable on its own, so a broken sidecar is just left incomplete
+            print(f"Error writing sidecar: {e}")
+            self.failed = True
+
+    def close(self):
+        if self.failed:
+            return False
+        # The manifest goes last so readers never see a partially written sidecar
+        try:
+            upload_blob(f"{self.prefix}/manifest.json", json.dumps(self.manifest))
+        except Exception as e:
+            print(f"Error writing sidecar manifest: {e}")
+            self.failed = True
+            return False
+        prune_directory(sidecar_dir, sidecar_disk_limit)
+        return True
+
+def write_sidecar(pair_id, barcoding_file_id, all_sheets):
+    writer = SidecarWriter(pair_id, barcoding_file_id)
+    for sheet_name, sheet_data in all_sheets.items():
+        writer.add_sheet(sheet_name, sheet_data)
+    return writer.close()
+
+def sidecar_exists(pair_id, barcoding_file_id):
+    return get_container_client().get_blob_client(f"{sidecar_prefix(pair_id, barcoding_file_id)}/manifest.json").exists()
+
+# Sheet names of a pair from its sidecar manifest; None when the pair has no sidecar
+def sidecar_sheet_names(pair_id, barcoding_file_id):
+    try:
+        manifest = json.loads(read_blob(f"{sidecar_prefix(pair_id, barcoding_file_id)}/manifest.json"))
+    except azure_exceptions.ResourceNotFoundError:
+        return None
+    return [sheet["name"] for sheet in manifest["sheets"]]
+
+# Download the sidecar of a pair into the local sidecar directory, only the given sheet's file when sheet is set;
+# returns None when the pair has none
+def fetch_sidecar(pair_id, barcoding_file_id, sheet=None):
+    prefix = sidecar_prefix(pair_id, barcoding_file_id)
+    try:
+        manifest = json.loads(read_blob(f"{prefix}/manifest.json"))
+    except azure_exceptions.ResourceNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error reading sidecar manifest: {e}")
+        return None
+
+    local_dir = os.path.join(sidecar_dir, prefix)
+    os.makedirs(local_dir, exist_ok=True)
+
+    # Sidecar blobs never change, so files downloaded earlier are reused
+    container_url = get_container_url()
+    sheets = []
+    missing = []
+    for entry in manifest["sheets"]:
+        if sheet is not None and entry["name"] != sheet:
+            continue
+        local_path = os.path.join(local_dir, entry["blob"])
+        sheets.append((entry["name"], local_path))
+        if os.path.exists(local_path):
+            os.utime(local_path)  # Keep recently used sidecars out of the way of pruning
+        else:
+            missing.append((f"{container_url}/{prefix}/{entry['blob']}", local_path))
+
+    if not all(download_files(missing)):
+        return None
+    if missing:
+        prune_directory(sidecar_dir, sidecar_disk_limit)
+
+    return sheets
+
+# Load the fetched sidecar sheets through a memory map
+def load_sidecar(sheets, metadata_df):
+    # Only samples described by the metadata can end up in a diagram
+    samples = set(metadata_df.dropna(subset=COMBINATION_COLUMNS)["ESV_ID"].astype(str))
+
+    all_sheets = {}
+    for sheet_name, local_path in sheets:
+        # Project the taxonomy columns and the relevant sample columns only
+        names = pq.read_schema(local_path).names
+        taxonomy_columns = [column for column in taxonomy_columns_for(sheet_name) if column in names]
+        sample_columns = [column for column in names[8:] if column in samples]
+        table = pq.read_table(local_path, columns=taxonomy_columns + sample_columns, memory_map=True)
+
+        sheet_data = table.to_pandas()
+        sheet_data.attrs["sample_columns"] = sample_columns
+        all_sheets[sheet_name] = sheet_data
+
+    return all_sheets
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import requests
+from requests.adapters import HTTPAdapter
+from app.lazy import lazy_import
+from app.metrics import record_blob
+
+azure_core = lazy_import("azure.core")
+azure_transport = lazy_import("azure.core.pipeline.transport")
+azure_blob = lazy_import("azure.storage.blob")
+
+account_name = os.getenv("AZURE_STORAGE_ACCOUNT_NAME")
+account_key = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
+container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
+
+# AZURE_STORAGE_CONNECTION_STRING points the app at another endpoint, e.g. a local Azurite emulator
+connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING") or (
+    f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
+)
+
+pool_size = int(os.getenv("BLOB_CONNECTION_POOL_SIZE", 32))
+max_concurrency = int(os.getenv("BLOB_MAX_CONCURRENCY", 4))  # Parallel ranged requests per blob transfer
+stream_chunk_size = int(os.getenv("BLOB_STREAM_CHUNK_BYTES", 1024 * 1024))  # Memory held per streamed download
+
+_lock = threading.Lock()
+_transport = None
+_service_client = None
+
+# Blob transfers that run alongside the request thread
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("BLOB_TRANSFER_WORKERS", 8)), thread_name_prefix="edna-blob")
+
+# Run a transfer on the pool in a copy of the caller's context, so its metrics count towards the caller's request
+def submit(func, *args):
+    return executor.submit(copy_context().run, func, *args)
+
+# One HTTP connection pool shared by every blob client of the process
+def get_transport():
+    global _transport
+    with _lock:
+        if _transport is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _transport = azure_transport.RequestsTransport(session=session, session_owner=False)
+        return _transport
+
+def get_service_client():
+    global _service_client
+    transport = get_transport()
+    with _lock:
+        if _service_client is None:
+            _service_client = azure_blob.BlobServiceClient.from_connection_string(connection_string, transport=transport)
+        return _service_client
+
+def get_container_client():
+    return get_service_client().get_container_client(container_name)
+
+def get_container_url():
+    return get_container_client().url
+
+# Same credential as the service client, whether it came from the connection string or the account key
+def blob_client_from_url(blob_url, **kwargs):
+    return azure_blob.BlobClient.from_blob_url(blob_url, credential=get_service_client().credential, transport=get_transport(), **kwargs)
+
+def get_blob_properties(blob_url):
+    return blob_client_from_url(blob_url).get_blob_properties()
+
+def get_blob_etag(blob_url):
+    try:
+        return blob_client_from_url(blob_url).get_blob_properties().etag
+    except Exception as e:
+        print(f"Error fetching blob properties: {e}")
+        return None
+
+def get_blob_etags(blob_urls):
+    futures = [submit(get_blob_etag, blob_url) for blob_url in blob_urls]
+    return [future.result() for future in futures]
+
+# Stream a blob into an open file or buffer with parallel ranged reads
+def download_to_stream(blob_url, stream):
+    start = time.perf_counter()
+    nbytes = blob_client_from_url(blob_url).download_blob(max_concurrency=max_concurrency).readinto(stream)
+    record_blob("download", nbytes, time.perf_counter() - start)
+    return nbytes
+
+def read_blob(blob_name):
+    start = time.perf_counter()
+    data = get_container_client().get_blob_client(blob_name).download_blob().readall()
+    record_blob("download", len(data), time.perf_counter() - start)
+    return data
+
+# Iterate over a blob, or a byte range of it, in bounded chunks; an ETag pins the version being read
+def iter_blob_chunks(blob_url, offset=None, length=None, etag=None):
+    blob_client = blob_client_from_url(blob_url, max_single_get_size=stream_chunk_size, max_chunk_get_size=stream_chunk_size)
+    conditions = {"etag": etag, "match_condition": azure_core.MatchConditions.IfNotModified} if etag else {}
+    chunks = blob_client.download_blob(offset=offset, length=length, **conditions).chunks()
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        record_blob("stream", len(chunk), time.perf_counter() - start)
+        yield chunk
+
+def download_file_from_url_with_auth(blob_url, download_file_path):
+    try:
+        # Write to a temporary file first so concurrent requests never read a partial download
+        temp_path = f"{download_file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            download_to_stream(blob_url, file)
+        os.replace(temp_path, download_file_path)
+        return download_file_path
+    except Exception as e:
+        print(f"Error during download: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+# Download several blobs concurrently; returns the paths in order, None for failed downloads
+def download_files(downloads):
+    futures = [submit(download_file_from_url_with_auth, blob_url, path) for blob_url, path in downloads]
+    return [future.result() for future in futures]
+
+def upload_blob(blob_name, data, **kwargs):
+    blob_client = get_container_client().get_blob_client(blob_name)
+    start = time.perf_counter()
+    result = blob_client.upload_blob(data, overwrite=True, max_concurrency=max_concurrency, **kwargs)
+    # Streams end up positioned after the uploaded content
+    nbytes = len(data) if isinstance(data, (bytes, str)) else data.tell()
+    record_blob("upload", nbytes, time.perf_counter() - start)
+    return blob_client, result
+
+# Best-effort removal of every blob under a prefix, e.g. a pair whose upload failed halfway
+def delete_blob_prefix(prefix):
+    container_client = get_container_client()
+    try:
+        for blob in container_client.list_blobs(name_starts_with=prefix):
+            container_client.delete_blob(blob.name)
+    except Exception as e:
+        print(f"Error deleting blobs under {prefix}: {e}")
@@ -0,0 +1,98 @@
+import json
+from functools import lru_cache
+from app.barcoding import taxonomy_columns_for
+from app.lazy import lazy_import
+from app.metrics import stage
+from app.rendering import group_counts
+
+pio = lazy_import("plotly.io")
+plotly_json = lazy_import("plotly.io.json")
+
+try:
+    import orjson  # Optional; much faster than the standard library for these payloads
+except ImportError:
+    orjson = None
+
+# The lean format sends plain sunburst traces instead of complete plotly figures:
+#   {"layout": <shared layout and template>, "diagrams": {key: {sheet: {"data": [trace], "layout": {"title": ...}}}}}
+# The client merges each diagram's layout over the shared one. Traces hold the same
+# ids/labels/parents/values as the plotly.express figures, built straight from the counts.
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+@lru_cache(maxsize=1)
+def shared_layout():
+    return {
+        "template": json.loads(plotly_json.to_json_plotly(pio.templates[pio.templates.default].to_plotly_json())),
+        "legend": {"tracegroupgap": 0},
+        "margin": {"t": 50, "l": 0, "r": 0, "b": 0},
+        "autosize": True,
+    }
+
+# Keep the top leaves by count and/or the leaves with at least min_count detections
+def prune(sunburst_data, top=None, min_count=None):
+    if min_count:
+        sunburst_data = sunburst_data[sunburst_data["Count"] >= min_count]
+    if top:
+        sunburst_data = sunburst_data.nlargest(top, "Count")
+    return sunburst_data
+
+HOVER_COLUMNS = ["Hive", "Location", "Date"]
+
+def build_trace(sheet_name, sunburst_data):
+    taxonomy_columns = taxonomy_columns_for(sheet_name)
+
+    # Every node sums the counts of the rows below it; a path stops at its first missing level
+    nodes = {}  # id -> [label, parent id, value]
+    for *path, count in sunburst_data[taxonomy_columns + ["Count"]].itertuples(index=False):
+        parent = ""
+        for label in path:
+            if label is None or label != label:
+                break
+            label = str(label)
+            node_id = f"{parent}/{label}" if parent else label
+            node = nodes.get(node_id)
+            if node is None:
+                node = nodes[node_id] = [label, parent, 0]
+            node[2] += int(count)
+            parent = node_id
+
+    # A diagram covers one combination, so its hover details are the same for every node. They come from
+    # the uploaded metadata and go in customdata, as plotly.express does, so the template never contains them.
+    first = sunburst_data.iloc[0] if len(sunburst_data) else {}
+    details = [str(first.get(column, "")) for column in HOVER_COLUMNS]
+    hover = "".join(f"<br>{column}=%{{customdata[{index}]}}" for index, column in enumerate(HOVER_COLUMNS))
+    return {
+        "type": "sunburst",
+        "ids": list(nodes),
+        "labels": [node[0] for node in nodes.values()],
+        "parents": [node[1] for node in nodes.values()],
+        "values": [node[2] for node in nodes.values()],
+        "branchvalues": "total",
+        "customdata": [details] * len(nodes),
+        "hovertemplate": "labels=%{label}<br>parent=%{parent}<br>id=%{id}" + hover + "<extra></extra>",
+        "name": "",
+        "domain": {"x": [0.0, 1.0], "y": [0.0, 1.0]},
+    }
+
+def iter_lean_diagrams(sheet_counts, top=None, min_count=None):
+    for key, sheets in group_counts(sheet_counts).items():
+        diagrams = {}
+        with stage("figure"):
+            for sheet_name, sunburst_data in sheets.items():
+                sunburst_data = prune(sunburst_data, top, min_count)
+                if len(sunburst_data):
+                    diagrams[sheet_name] = {
+                        "data": [build_trace(sheet_name, sunburst_data)],
+                        "layout": {"title": {"text": f"Taxonomy Sunburst for {sheet_name}"}},
+                    }
+        if diagrams:
+            yield key, diagrams
+
+def render_lean_payload(sheet_counts, top=None, min_count=None):
+    diagrams = dict(iter_lean_diagrams(sheet_counts, top, min_count))
+    with stage("encode"):
+        return dumps({"layout": shared_layout(), "diagrams": diagrams})
@@ -0,0 +1,77 @@
+import os
+from sqlalchemy import insert, delete, select
+from app.database import db, execute_read
+from app.models import TaxonIndex
+
+# t_taxon_index maps genus and species names to where they were detected, so a search across all
+# uploads is one index range scan. Entries are added per sheet at upload and removed with the pair.
+search_limit = int(os.getenv("TAXON_SEARCH_LIMIT", 500))  # Most entries one search returns
+
+TAXON_RANKS = ["genus", "species"]  # Occurrence columns that are indexed, named after their rank
+SEARCH_COLUMNS = [
+    TaxonIndex.taxon_name,
+    TaxonIndex.taxon_rank,
+    TaxonIndex.sheet_name,
+    TaxonIndex.farm_id,
+    TaxonIndex.pair_id,
+    TaxonIndex.location,
+    TaxonIndex.hive,
+    TaxonIndex.date,
+    TaxonIndex.count,
+]
+
+# Names are compared as text; a numeric Genus or Species cell is indexed by its digits
+def taxon_key(name):
+    return str(name).strip().lower()
+
+# Count the samples every genus and species of a sheet was detected in, by farm, hive and date.
+# A sample holding several species of one genus counts once for the genus.
+def index_rows(pair_id, farm_id, sheet_name, occurrences):
+    rows = []
+    combination = ["location", "hive", "date"]
+    for rank in TAXON_RANKS:
+        if rank not in occurrences:
+            continue
+        named = occurrences[occurrences[rank].notna()]
+        counts = named.groupby([rank] + combination, dropna=False)["esv_id"].nunique().reset_index(name="count")
+        counts = counts.astype(object).where(counts.notna(), None)  # Missing metadata groups come back as NaN
+        for name, location, hive, date, count in counts.itertuples(index=False):
+            rows.append({
+                "taxon_key": taxon_key(name),
+                "taxon_name": str(name),
+                "taxon_rank": rank,
+                "sheet_name": sheet_name,
+                "farm_id": farm_id,
+                "pair_id": pair_id,
+                "location": location,
+                "hive": hive,
+                "date": date,
+                "count": int(count),
+            })
+    return rows
+
+# Add the entries of one sheet's occurrences (see app.occurrences.occurrence_frame) inside the caller's transaction
+def index_taxa(pair_id, farm_id, sheet_name, occurrences):
+    rows = index_rows(pair_id, farm_id, sheet_name, occurrences)
+    if rows:
+        db.session.execute(insert(TaxonIndex), rows)
+    return len(rows)
+
+def delete_taxa(pair_id):
+    db.session.execute(delete(TaxonIndex.__table__).where(TaxonIndex.pair_id == pair_id))
+
+# Keys starting with prefix sort from prefix up to, not including, prefix with its last character incremented
+def prefix_upper_bound(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+# Entries whose taxon name starts with the given text, ignoring case. A range on the lowercased key,
+# unlike LIKE, uses the index on every database whatever its collation.
+def search_taxa(text, limit=search_limit):
+    prefix = taxon_key(text)
+    query = (
+        select(*SEARCH_COLUMNS)
+        .where(TaxonIndex.taxon_key >= prefix, TaxonIndex.taxon_key < prefix_upper_bound(prefix))
+        .order_by(TaxonIndex.taxon_key, TaxonIndex.date, TaxonIndex.taxon_index_id)
+        .limit(limit)
+    )
+    return execute_read(query).all()
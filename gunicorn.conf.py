@@ -0,0 +1,14 @@
+import os
+
+# gunicorn reads this file from the working directory.
+# GUNICORN_PRELOAD=1 loads the app, heavy dependencies included, once in the master process,
+# so forked workers share those pages copy-on-write instead of each importing them on first use.
+preload_app = os.getenv("GUNICORN_PRELOAD", "").lower() in ("1", "true", "yes")
+if preload_app:
+    os.environ.setdefault("PRELOAD_HEAVY_MODULES", "1")
+
+# Threaded workers, so a worker relaying a long AI answer (or waiting on blob storage) keeps serving
+# other requests on its remaining threads instead of being held for the whole generation
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 180))
@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+# Config reads the environment on import, so point it at a throwaway SQLite database first
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "edna-test.db")
+os.environ["PASSWORD_HASH_WORKERS"] = "0"
+
+import pytest
+from app import create_app
+from app.database import db
+from app.reference import reference_cache
+from app.routes.visualization_routes import visualization_counts
+
+@pytest.fixture
+def app():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    reference_cache.invalidate()
+    visualization_counts.invalidate()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+import pytest
+import app.routes.file_routes as file_routes
+
+DATA = bytes(range(256)) * 40
+ETAG = '"0x8DCABC"'
+BLOB_URL = "https://account.blob.core.windows.net/container/pair/file.xlsx"
+
+@pytest.fixture(autouse=True)
+def blob(monkeypatch):
+    properties = SimpleNamespace(etag=ETAG, size=len(DATA), content_settings=SimpleNamespace(content_type="application/octet-stream"))
+    monkeypatch.setattr(file_routes, "get_blob_properties", lambda blob_url: properties)
+
+    def iter_blob_chunks(blob_url, offset=None, length=None, etag=None):
+        body = DATA[offset:offset + length]
+        return iter([body[start:start + 1000] for start in range(0, len(body), 1000)])
+    monkeypatch.setattr(file_routes, "iter_blob_chunks", iter_blob_chunks)
+
+def download(client, **headers):
+    response = client.post("/file/download", json={"blob_url": BLOB_URL}, headers=headers)
+    response.get_data()
+    return response
+
+def test_whole_file(client):
+    response = download(client)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["ETag"] == ETAG
+
+def test_single_range(client):
+    response = download(client, Range="bytes=10-19")
+    assert response.status_code == 206
+    assert response.data == DATA[10:20]
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(DATA)}"
+
+def test_suffix_range(client):
+    response = download(client, Range="bytes=-5")
+    assert response.status_code == 206
+    assert response.data == DATA[-5:]
+
+def test_unsatisfiable_range(client):
+    response = download(client, Range=f"bytes={len(DATA)}-")
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(DATA)}"
+
+def test_multiple_ranges_get_the_whole_file(client):
+    response = download(client, Range="bytes=0-1,5-9")
+    assert response.status_code == 200
+    assert response.data == DATA
+
+def test_if_none_match(client):
+    response = download(client, **{"If-None-Match": ETAG})
+    assert response.status_code == 304
+    assert response.data == b""
+
+def test_if_range_matching(client):
+    response = download(client, Range="bytes=0-1", **{"If-Range": ETAG})
+    assert response.status_code == 206
+    assert response.data == DATA[:2]
+
+def test_if_range_not_matching(client):
+    response = download(client, Range="bytes=0-1", **{"If-Range": '"0xOTHER"'})
+    assert response.status_code == 200
+    assert response.data == DATA
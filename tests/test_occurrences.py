@@ -0,0 +1,33 @@
+import pandas as pd
+import app.occurrences as occurrences
+from app.database import db
+from app.models import TaxonIndex, TaxonOccurrence
+
+def frame(sheet_name, genus):
+    return pd.DataFrame([{
+        "taxon_class": "Insecta", "genus": genus, "species": None, "esv_id": "S1",
+        "location": "FarmA", "hive": "1", "date": "2024-01-01", "presence": 1.0, "sheet_name": sheet_name,
+    }])
+
+def test_a_rejected_sheet_is_skipped(app, monkeypatch):
+    index_taxa = occurrences.index_taxa
+
+    def failing_index_taxa(pair_id, farm_id, sheet_name, sheet_occurrences):
+        if sheet_name == "Fungi":
+            raise RuntimeError("Data too long for column 'genus'")
+        return index_taxa(pair_id, farm_id, sheet_name, sheet_occurrences)
+    monkeypatch.setattr(occurrences, "index_taxa", failing_index_taxa)
+
+    assert occurrences.record_occurrences("p1", "f1", "Insects", frame("Insects", "Apis"))
+    assert not occurrences.record_occurrences("p1", "f1", "Fungi", frame("Fungi", "Aspergillus"))
+    db.session.commit()
+
+    # The occurrences of the rejected sheet were rolled back with its index entries
+    assert [row.sheet_name for row in TaxonOccurrence.query.all()] == ["Insects"]
+    assert [row.taxon_name for row in TaxonIndex.query.all()] == ["Apis"]
+
+def test_rollback_discards_recorded_sheets(app):
+    occurrences.record_occurrences("p1", "f1", "Insects", frame("Insects", "Apis"))
+    db.session.rollback()
+    assert TaxonOccurrence.query.count() == 0
+    assert TaxonIndex.query.count() == 0
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+import pytest
+from app.database import db
+from app.models import File, Visualization
+
+@pytest.fixture
+def visualizations(app):
+    # Three share a timestamp, so pages of two split the tie
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    created = [now, now, now, now - timedelta(minutes=1), now - timedelta(minutes=2)]
+    for index, created_at in enumerate(created):
+        db.session.add(Visualization(visualization_id=f"vis-{index}", pair_id=f"pair-{index}", created_at=created_at))
+    db.session.commit()
+    db.session.remove()
+
+def pages(client, path):
+    responses = []
+    while path:
+        response = client.get(path)
+        response.get_data()  # Listings stream, so finish each one before the next request
+        assert response.status_code == 200
+        responses.append(response)
+        cursor = response.headers.get("X-Next-Cursor")
+        path = f"/visualization/visualizations?limit=2&cursor={cursor}" if cursor else None
+    return responses
+
+def test_pages_split_ties_without_duplicates(client, visualizations):
+    responses = pages(client, "/visualization/visualizations?limit=2")
+    ids = [row["id"] for response in responses for row in response.get_json()]
+    assert [len(response.get_json()) for response in responses] == [2, 2, 1]
+    # Newest first, ties by id descending
+    assert ids == ["vis-2", "vis-1", "vis-0", "vis-3", "vis-4"]
+
+def test_last_page_has_no_next_cursor(client, visualizations):
+    last = pages(client, "/visualization/visualizations?limit=2")[-1]
+    assert "X-Next-Cursor" not in last.headers
+    assert "Link" not in last.headers
+
+def test_next_link_carries_the_cursor(client, visualizations):
+    response = client.get("/visualization/visualizations?limit=2")
+    response.get_data()
+    link = response.headers["Link"]
+    assert link.endswith('; rel="next"')
+    assert parse_qs(urlparse(link[1:link.index(">")]).query)["cursor"] == [response.headers["X-Next-Cursor"]]
+
+@pytest.mark.parametrize("cursor", ["garbage", "bm90IGpzb24", "WyJub3QgYSBkYXRlIiwgIngiXQ"])
+def test_invalid_cursor(client, cursor):
+    response = client.get(f"/visualization/visualizations?cursor={cursor}")
+    assert response.status_code == 400
+    assert response.get_json() == {"message": "Invalid cursor"}
+
+def test_unknown_fields(client):
+    db.session.add(File(pair_id="pair-0", file_type="metadata", file_name="m.csv", file_url="https://x/m.csv"))
+    db.session.commit()
+    response = client.get("/file/files?fields=file_id,secret")
+    assert response.status_code == 400
+    assert "secret" in response.get_json()["message"]
+
+def test_selected_fields(client):
+    db.session.add(File(pair_id="pair-0", file_type="metadata", file_name="m.csv", file_url="https://x/m.csv"))
+    db.session.commit()
+    response = client.get("/file/files?fields=file_name,file_type")
+    assert response.get_json() == [{"file_name": "m.csv", "file_type": "metadata"}]
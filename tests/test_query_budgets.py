@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+import pytest
+from app.cli import LISTING_QUERY_BUDGETS
+from app.database import db
+from app.metrics import assert_max_queries
+from app.models import Farm, File, Role, TaxonIndex, User, Visualization, VisualizationPermisson
+
+IDS = {"farm_id": "farm-1", "user_id": "user-1"}
+
+@pytest.fixture
+def seeded(app):
+    now = datetime.utcnow()
+    db.session.add(Role(role_id=1, role_name="Farmer"))
+    db.session.add(Farm(farm_id="farm-1", farm_name="Farm", location="AU"))
+    db.session.add(User(user_id="user-1", username="farmer", role_id=1, email="farmer@example.com", password_hash="x", farm_id="farm-1"))
+    for index in range(5):
+        pair_id = f"pair-{index}"
+        db.session.add(Visualization(visualization_id=f"vis-{index}", pair_id=pair_id, farm_id="farm-1", created_at=now - timedelta(minutes=index)))
+        db.session.add(VisualizationPermisson(visualization_id=f"vis-{index}", user_id="user-1"))
+        db.session.add(File(pair_id=pair_id, file_type="metadata", file_name="m.csv", file_url="https://x/m.csv", user_id="user-1", farm_id="farm-1"))
+        db.session.add(TaxonIndex(taxon_key="apis", taxon_name="Apis", taxon_rank="genus", sheet_name="Insects", farm_id="farm-1", pair_id=pair_id, count=1))
+    db.session.commit()
+    db.session.remove()
+
+@pytest.mark.parametrize("path, limit", LISTING_QUERY_BUDGETS.items())
+def test_listing_stays_within_budget(client, seeded, path, limit):
+    path = path.format(**IDS)
+    response = client.get(path)  # Warm the reference and count caches first
+    response.get_data()
+    assert response.status_code == 200, path
+
+    with assert_max_queries(limit, path):
+        response = client.get(path)
+        assert response.get_json()
@@ -0,0 +1,36 @@
+import pandas as pd
+from app.taxon_index import index_rows, prefix_upper_bound
+
+def occurrences(rows):
+    return pd.DataFrame(rows, columns=["genus", "species", "esv_id", "location", "hive", "date"])
+
+def test_genus_counts_samples_not_species():
+    # S1 detects Apis through two species; S2 through one
+    frame = occurrences([
+        ["Apis", "Apis mellifera", "S1", "FarmA", "1", "2024-01-01"],
+        ["Apis", "Apis cerana", "S1", "FarmA", "1", "2024-01-01"],
+        ["Apis", "Apis mellifera", "S2", "FarmA", "1", "2024-01-01"],
+    ])
+    counts = {(row["taxon_rank"], row["taxon_name"]): row["count"] for row in index_rows("p1", "f1", "Insects", frame)}
+    assert counts == {
+        ("genus", "Apis"): 2,
+        ("species", "Apis mellifera"): 2,
+        ("species", "Apis cerana"): 1,
+    }
+
+def test_entries_keep_missing_metadata_as_none():
+    frame = occurrences([["Apis", None, "S1", None, "1", "2024-01-01"]])
+    (row,) = index_rows("p1", "f1", "Insects", frame)
+    assert row["taxon_key"] == "apis"
+    assert row["location"] is None
+    assert row["count"] == 1
+
+def test_prefix_upper_bound():
+    assert prefix_upper_bound("apis") == "apit"
+    assert "apis mellifera" < prefix_upper_bound("apis")
+
+def test_numeric_names_are_indexed_as_text():
+    frame = occurrences([[1234, None, "S1", "FarmA", "1", "2024-01-01"]])
+    (row,) = index_rows("p1", "f1", "Insects", frame)
+    assert row["taxon_key"] == "1234"
+    assert row["taxon_name"] == "1234"